@@ -1,8 +1,21 @@
 #!/usr/bin/python3
 
-from owlready2 import (SOME, And, Restriction, Thing, ThingClass, get_ontology,
+import json
+import sys
+import time
+
+from owlready2 import (And, Restriction, Thing, ThingClass, get_ontology,
                        set_log_level)
 
+from class_index import AmbiguousClassName, ClassIndex
+from el_saturation import BitsetSaturation, Budget, RuleStats, Saturation
+from el_tbox import compile_tbox
+from subsumption_cache import (cache_path, file_hash, load_classification,
+                               save_classification)
+
+# Classes left out of the formatted subsumer lists
+FILTERED_CLASS_NAMES = ['ValuePartition', 'Thing', 'DomainConcept']
+
 set_log_level(0)
 
 
@@ -12,143 +25,347 @@ def load_ontology(file_path):
 
 
 class ELReasoner:
-    def __init__(self, ontology):
+    def __init__(self, ontology, shared_successors=True, cache_size=None, instrument=False, bitset_labels=False,
+                 budget=None, class_budget=None):
         self.ontology = ontology
+        self.shared_successors = shared_successors
+        # Store element labels as int bitsets (BitsetSaturation) instead of sets
+        self.bitset_labels = bitset_labels
+        # Count and time every rule application (see rule_stats())
+        self.instrument = instrument
+        # Size limit of the told closure and construct caches (None: unbounded)
+        self.cache_size = cache_size
+        # Budget of classify(), and of every compute_subsumers() call that has to
+        # saturate (a class outside the classification, or continuing one that was
+        # cut off) and every are_subsumed() call that has to saturate. The time limit
+        # counts from the start of the saturation including compiling, but only stops
+        # the rules. Without a class budget a cut-off classification stays as it is.
+        self.budget = budget
+        self.class_budget = class_budget
+        # Limit ("time", "elements" or "memory") the saturation was cut off at; the
+        # subsumers found so far are then returned, but may be incomplete
+        self.cutoff = None
+        # Limit the last are_subsumed() call was cut off at before it decided every
+        # pair. Kept apart from cutoff: stopping once the goals are reached leaves the
+        # model short of its fixpoint without the classification being cut off.
+        self.query_cutoff = None
+        # Compiled normal form of the ontology and the shared model, built on first use
+        self.tbox = None
+        self.saturation = None
+        # Subsumers of every class, filled by classify()
+        self.subsumer_map = None
+        self.class_index = None
+        # Memory-mapped classification loaded by classify_cached(), with its concept
+        # IDs by IRI and subsumer IDs by root concept ID once is_subsumed() needs them
+        self.cached_classification = None
+        self.cached_concept_ids = None
+        self.cached_subsumer_ids = None
 
-    def add_element(self, element, concept, elements):
-        if element not in elements:
-            elements[element] = set()
-        elements[element].add(concept)
-
-    def apply_T_rule(self, concepts):
-        if Thing not in concepts:
-            concepts.add(Thing)
-            return True
-        return False
-
-    def apply_conjunction_rule(self, concepts):
-        changed = False
-        for concept in concepts.copy():
-            if isinstance(concept, And):
-                for part in concept.Classes:
-                    if part not in concepts:
-                        concepts.add(part)
-                        changed = True
-        return changed
+    # Name -> class index of the ontology, built on first use
+    def get_class_index(self):
+        if self.class_index is None:
+            self.class_index = ClassIndex(self.ontology)
+        return self.class_index
 
-    def apply_existential_restriction_rule(self, element, concepts, elements, role_successors):
-        changed = False
-        for concept in concepts.copy():
-            if isinstance(concept, Restriction) and concept.type == SOME:
-                relation = concept.property
-                filler = concept.value  # Use value instead of filler
-
-                # Check for an existing r-successor
-                if element in role_successors and relation in role_successors[element]:
-                    for succ_element in role_successors[element][relation]:
-                        if filler not in elements[succ_element]:
-                            elements[succ_element].add(filler)
-                            changed = True
-                else:
-                    # Create a new r-successor
-                    new_element = f'{element}_{relation.name}'
-                    self.add_element(new_element, filler, elements)
-                    # Track the new r-successor
-                    if element not in role_successors:
-                        role_successors[element] = {}
-                    if relation not in role_successors[element]:
-                        role_successors[element][relation] = set()
-                    role_successors[element][relation].add(new_element)
-                    changed = True
-        return changed
+    # Compile the ontology into the integer-indexed EL normal form once; the rules
+    # only run on these tables afterwards
+    def compile(self):
+        if self.tbox is None:
+            if self.cached_classification is not None:
+                self.tbox = self.cached_classification.restore_tbox(self.ontology.world.__getitem__, self.cache_size)
+            else:
+                self.tbox = compile_tbox(self.ontology, self.cache_size)
+            saturation_class = BitsetSaturation if self.bitset_labels else Saturation
+            self.saturation = saturation_class(self.tbox, self.shared_successors, RuleStats() if self.instrument else None)
+        return self.tbox
 
-    def apply_subclass_rule(self, concepts):
-        changed = False
-        for concept in concepts.copy():
-            if not isinstance(concept, ThingClass):
+    def filter_and_format_subsumers(self, subsumers, target_class):
+        names = []
+        for cls in subsumers:
+            if cls is Thing:
                 continue
-            # Retrieve all ancestors (superclasses) of the concept
-            for super_concept in concept.ancestors(include_self=False):
-                if super_concept not in concepts:
-                    concepts.add(super_concept)
-                    changed = True
-        return changed
+            if isinstance(cls, ThingClass) and not isinstance(cls, Restriction) and not isinstance(cls, And):
+                names.append(cls.name if hasattr(cls, 'name') else str(cls))
+        return self.filter_subsumer_names(names, target_class.name)
 
-    def apply_role_successor_rule(self, element, concepts, elements, role_successors):
-        changed = False
-        # For each role successor, if the role is not already assigned to the element, assign it
-        for role, successors in role_successors.get(element, {}).items():
-            for successor in successors:
-                # Check if 'successor' has a concept 'C' assigned
-                for concept in elements[successor]:
-                    # Check if there is an existential restriction ∃r.C in the ontology
-                    existential_restriction = role.some(concept)
-                    if existential_restriction not in concepts:
-                        # Assign ∃r.C to the current element 'd'
-                        concepts.add(existential_restriction)
-                        changed = True
-        return changed
+    def filter_subsumer_names(self, names, target_name):
+        filtered_subsumers = [name for name in names if name not in FILTERED_CLASS_NAMES]
+        if target_name not in filtered_subsumers:
+            filtered_subsumers.append(target_name)
+        return filtered_subsumers
 
-    def apply_rules(self, elements, role_successors):
-        changed = True
-        while changed:
-            changed = False
-            for element in list(elements.keys()):
-                concepts = elements[element]
+    # Saturate the given classes together in one shared model, every class is the
+    # root concept of its own element
+    def saturate(self, classes, precompute_closures=False, budget=None):
+        if budget is not None:
+            budget.start()
+        tbox = self.compile()
+        for target_class in classes:
+            self.saturation.add_root(tbox.add_class(target_class))
+        # Start every class from the told closures, computed for all concepts at once
+        if precompute_closures:
+            tbox.precompute_told_closures()
 
-                # Apply all rules
-                changed |= self.apply_T_rule(concepts)
-                changed |= self.apply_conjunction_rule(concepts)
-                changed |= self.apply_existential_restriction_rule(element, concepts, elements, role_successors)
-                changed |= self.apply_subclass_rule(concepts)
-                changed |= self.apply_role_successor_rule(element, concepts, elements, role_successors)
+        self.run_saturation(budget)
+        return self.subsumers_of(classes)
 
-        return elements
+    # Run the saturation within a started budget. When it reaches the fixpoint after
+    # an earlier run was cut off, the subsumers of every classified class are brought
+    # up to date.
+    def run_saturation(self, budget=None):
+        self.drop_cached_classification()
+        complete = self.saturation.run(budget)
+        if complete and self.cutoff is not None and self.subsumer_map is not None:
+            self.subsumer_map.update(self.subsumers_of(self.subsumer_map))
+        self.cutoff = self.saturation.cutoff
 
-    def initialize_elements_with_class_and_equivalents(self, element, target_class, elements):
-        self.add_element(element, target_class, elements)
-        if hasattr(target_class, 'equivalent_to'):
-            for eq_class in target_class.equivalent_to:
-                if isinstance(eq_class, (And, Restriction)):
-                    self.add_element(element, eq_class, elements)
+    # Forget the classification loaded by classify_cached(), which no longer answers
+    # for the model once it is saturated further (e.g. by add_axioms())
+    def drop_cached_classification(self):
+        self.cached_classification = None
+        self.cached_concept_ids = None
+        self.cached_subsumer_ids = None
 
+    # Formatted subsumers of classes already in the model, from their current labels
+    def subsumers_of(self, classes):
+        tbox = self.tbox
+        subsumer_map = {}
+        for target_class in classes:
+            element = self.saturation.root_elements[tbox.concept_ids[target_class]]
+            subsumers = [tbox.concepts[concept_id] for concept_id in self.saturation.subsumer_ids(element)]
+            subsumer_map[target_class] = self.filter_and_format_subsumers(subsumers, target_class)
+        return subsumer_map
 
-    def filter_and_format_subsumers(self, subsumers, target_class):
-        filtered_subsumers = []
-        # List of concepts to be filtered out
-        filter_out = ['ValuePartition', 'Thing', 'DomainConcept']
-        for cls in subsumers:
-            if cls is Thing:
-                continue
-            if isinstance(cls, ThingClass) and not isinstance(cls, Restriction) and not isinstance(cls, And):
-                cls_name = cls.name if hasattr(cls, 'name') else str(cls)
-                # Check if the concept is in the filter_out list
-                if cls_name not in filter_out:
-                    filtered_subsumers.append(cls_name)
-        if target_class.name not in filtered_subsumers:
-            filtered_subsumers.append(target_class.name)
-        return filtered_subsumers
+    # Classify the whole ontology in a single saturation (as ELK does) and return
+    # the subsumers of every class, keyed by class name
+    def classify(self):
+        if self.subsumer_map is None:
+            self.subsumer_map = self.saturate(list(self.ontology.classes()), precompute_closures=True, budget=self.budget)
+        class_index = self.get_class_index()
+        return {class_index.unique_name(target_class): subsumers for target_class, subsumers in self.subsumer_map.items()}
 
-    def compute_subsumers(self, class_name):
-        # Initialize elements and role_successors dictionaries
-        elements = {}
-        role_successors = {}
+    # Classify through the on-disk cache in cache_dir, keyed by the content hash of
+    # ontology_file. A valid cache file is memory-mapped instead of reasoning again;
+    # a missing, stale or corrupt one is rebuilt.
+    def classify_cached(self, ontology_file, cache_dir):
+        digest = file_hash(ontology_file)
+        path = cache_path(cache_dir, ontology_file)
+        cached = load_classification(path, digest)
+        if cached is None:
+            result = self.classify()
+            # A cut-off classification is not worth keeping
+            if self.cutoff is not None:
+                return result
+            tbox = self.tbox
+            subsumer_ids = {}
+            for target_class in self.subsumer_map:
+                concept_id = tbox.concept_ids[target_class]
+                subsumer_ids[concept_id] = self.saturation.subsumer_ids(self.saturation.root_elements[concept_id])
+            save_classification(path, digest, tbox, subsumer_ids)
+            return result
+
+        self.cached_classification = cached
+        class_index = self.get_class_index()
+        concept_iris = cached.header["concept_iris"]
+        concept_names = cached.header["concept_names"]
+        self.subsumer_map = {}
+        for root, subsumers in cached.subsumer_ids().items():
+            target_class = class_index.by_iri.get(concept_iris[root])
+            if target_class is not None:
+                names = [concept_names[concept_id] for concept_id in subsumers]
+                self.subsumer_map[target_class] = self.filter_subsumer_names(names, target_class.name)
+        return self.classify()
+
+    # Add new subsumption (sub, super) and equivalence pairs of owlready2 concepts to a
+    # classified reasoner, e.g. right after adding them to the ontology. Only the
+    # consequences of the new axioms are pushed through the saturated model.
+    # Returns the names of the classes whose subsumers changed.
+    def add_axioms(self, subsumptions=(), equivalences=()):
+        tbox = self.compile()
+        if self.subsumer_map is None:
+            self.classify()
+        # A classification loaded from the on-disk cache has no model yet
+        missing = [target_class for target_class in self.subsumer_map
+                   if tbox.concept_ids.get(target_class) not in self.saturation.root_elements]
+        if missing:
+            self.saturate(missing)
 
-        target_class = self.ontology.search_one(iri="*" + class_name)
+        axioms = list(subsumptions)
+        for first, second in equivalences:
+            axioms.extend(((first, second), (second, first)))
+        tbox.touched.clear()
+        new_classes = []
+        for sub, sup in axioms:
+            tbox.add_axiom(sub, sup)
+            for concept in (sub, sup):
+                if isinstance(concept, ThingClass) and concept is not Thing and concept not in self.subsumer_map:
+                    new_classes.append(concept)
+
+        saturation = self.saturation
+        saturation.changed_elements = set()
+        saturation.refire(tbox.touched)
+        self.run_saturation()
+        changed_elements = saturation.changed_elements
+        saturation.changed_elements = None
+
+        class_index = self.get_class_index()
+        changed = []
+        for target_class, subsumers in self.subsumer_map.items():
+            element = saturation.root_elements[tbox.concept_ids[target_class]]
+            if element in changed_elements:
+                new_subsumers = self.filter_and_format_subsumers(
+                    [tbox.concepts[concept_id] for concept_id in saturation.subsumer_ids(element)], target_class)
+                if set(new_subsumers) != set(subsumers):
+                    self.subsumer_map[target_class] = new_subsumers
+                    changed.append(class_index.unique_name(target_class))
+        for target_class in dict.fromkeys(new_classes):
+            class_index.add(target_class)
+            self.subsumer_map.update(self.saturate([target_class]))
+            changed.append(class_index.unique_name(target_class))
+        return changed
+
+    # Subsumers of a class given by name, IRI or label. Raises AmbiguousClassName
+    # when a short name matches several classes.
+    def compute_subsumers(self, class_name):
+        target_class = self.get_class_index().lookup(class_name)
         if not target_class:
             return []
 
-        self.initialize_elements_with_class_and_equivalents('d0', target_class, elements)
-        self.apply_rules(elements, role_successors)
-        subsumers = set()
-        for concepts in elements.values():
-            subsumers.update(concepts)
+        if self.subsumer_map is None:
+            self.classify()
+        if target_class not in self.subsumer_map:
+            # Classes outside ontology.classes() (e.g. imported ones) are added to the model
+            self.subsumer_map.update(self.saturate([target_class], budget=self.class_budget))
+        elif self.cutoff is not None and self.class_budget is not None:
+            # Continue the cut-off classification for at most class_budget
+            self.run_saturation(self.class_budget.start())
+            self.subsumer_map.update(self.subsumers_of([target_class]))
+
+        return list(self.subsumer_map[target_class])
+
+    # Whether sub ⊑ super, for classes given by name, IRI or label (False when either
+    # is not found)
+    def is_subsumed(self, sub_name, super_name):
+        return self.are_subsumed([(sub_name, super_name)])[0]
+
+    # is_subsumed() for a list of (sub, super) pairs. Pairs are answered from the
+    # classification when there is one. For the others only the sub classes are
+    # added to the model, and the completion stops as soon as every super class was
+    # derived for its sub class; the full fixpoint is only reached for pairs that do
+    # not hold. Pairs left undecided at the class_budget are answered False (see
+    # query_cutoff).
+    def are_subsumed(self, pairs):
+        self.query_cutoff = None
+        class_index = self.get_class_index()
+        results = []
+        goals = {}
+        undecided = []
+        for sub_name, super_name in pairs:
+            sub_class = class_index.lookup(sub_name)
+            super_class = class_index.lookup(super_name)
+            result = None
+            if sub_class is None or super_class is None:
+                result = False
+            elif sub_class is super_class:
+                result = True
+            elif self.cached_classification is not None:
+                result = self.is_subsumed_cached(sub_class, super_class)
+            if result is None:
+                tbox = self.compile()
+                element = self.saturation.add_root(tbox.add_class(sub_class))
+                super_id = tbox.add_class(super_class)
+                goals.setdefault(element, set()).add(super_id)
+                undecided.append((len(results), element, super_id))
+            results.append(result)
+
+        if goals:
+            budget = self.class_budget.start() if self.class_budget is not None else None
+            self.saturation.run_until(goals, budget)
+            self.query_cutoff = self.saturation.cutoff
+            for index, element, super_id in undecided:
+                results[index] = self.saturation.has_concept(element, super_id)
+        return results
+
+    # Answer from the classification loaded by classify_cached(), or None when the
+    # class is not in it
+    def is_subsumed_cached(self, sub_class, super_class):
+        cached = self.cached_classification
+        if self.cached_concept_ids is None:
+            self.cached_concept_ids = {iri: concept_id for concept_id, iri in enumerate(cached.header["concept_iris"]) if iri is not None}
+            self.cached_subsumer_ids = cached.subsumer_ids()
+        subsumer_ids = self.cached_subsumer_ids.get(self.cached_concept_ids.get(sub_class.iri))
+        if subsumer_ids is None:
+            return None
+        return self.cached_concept_ids.get(super_class.iri) in subsumer_ids
+
+    # Hit/miss counters of the told closure and construct caches
+    def cache_stats(self):
+        return self.compile().cache_stats()
 
-        return self.filter_and_format_subsumers(subsumers, target_class)
+    # RuleStats of the saturation so far, None unless instrumented
+    def rule_stats(self):
+        if not self.instrument:
+            return None
+        return self.saturation.stats if self.saturation is not None else RuleStats()
 
-    # Compute all classes in the ontology
+    # Number of model elements created so far
+    @property
+    def elements_created(self):
+        return self.saturation.elements_created if self.saturation is not None else 0
+
+    # Compute all classes in the ontology, by names compute_subsumers resolves uniquely
     def compute_all_classes(self):
-        return [cls.name for cls in self.ontology.classes()]
+        class_index = self.get_class_index()
+        return [class_index.unique_name(cls) for cls in self.ontology.classes()]
+
+
+# Answer the subsumer queries of several classes from one load and one shared
+# saturation, as one TSV (class, subsumer per line) or JSON Lines stream
+def run_batch(reasoner, class_names, output_format, output=sys.stdout):
+    start_time = time.perf_counter()
+    reasoner.classify()
+    classification_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    count = 0
+    for class_name in class_names:
+        count += 1
+        try:
+            if reasoner.get_class_index().lookup(class_name) is None:
+                raise LookupError(f"no class '{class_name}'")
+            subsumers = reasoner.compute_subsumers(class_name)
+        except LookupError as e:
+            if output_format == "jsonl":
+                output.write(json.dumps({"class": class_name, "error": str(e)}, ensure_ascii=False) + "\n")
+            else:
+                print(f"{class_name}: {e}", file=sys.stderr)
+            continue
+        if output_format == "jsonl":
+            row = {"class": class_name, "subsumers": subsumers}
+            if reasoner.cutoff is not None:
+                row["incomplete"] = reasoner.cutoff
+            output.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            for subsumer in subsumers:
+                output.write(f"{class_name}\t{subsumer}\n")
+    query_time = time.perf_counter() - start_time
+    output.flush()
+
+    print(f"Classified in {classification_time:.3f} seconds, answered {count} classes in {query_time:.3f} seconds "
+          f"({count / query_time if query_time else 0:.0f} classes/second)", file=sys.stderr)
+    print_cutoff(reasoner)
+
+
+def print_cutoff(reasoner):
+    if reasoner.cutoff is not None:
+        print(f"Saturation stopped at the {reasoner.cutoff} limit, subsumers may be incomplete", file=sys.stderr)
+
+
+def read_class_names(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            yield line
 
 
 if __name__ == "__main__":
@@ -156,12 +373,41 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="EL Reasoner")
     parser.add_argument("ontology_file", type=str, help="Path to the ontology file")
-    parser.add_argument("class_name", type=str, help="Class name to find subsumers for")
+    parser.add_argument("class_name", type=str, nargs="?", help="Class name to find subsumers for")
+    parser.add_argument("-f", "--classes-file", type=str, help="File with one class name per line ('-' for stdin)")
+    parser.add_argument("--all", action="store_true", help="Find the subsumers of every class in the ontology")
+    parser.add_argument("--format", choices=["tsv", "jsonl"], default="tsv", help="Output format of the batch modes")
+    parser.add_argument("--time-limit", type=float, help="Stop the saturation after this many seconds")
+    parser.add_argument("--element-limit", type=int,
+                        help="Stop the saturation once it has created more model elements than this")
+    parser.add_argument("--memory-limit", type=float, help="Stop the saturation once the process uses more megabytes")
     args = parser.parse_args()
+    if sum(bool(mode) for mode in (args.class_name, args.classes_file, args.all)) != 1:
+        parser.error("give exactly one of class_name, --classes-file or --all")
 
+    start_time = time.perf_counter()
     ontology = load_ontology(args.ontology_file)
-    reasoner = ELReasoner(ontology)
-    subsumers = reasoner.compute_subsumers(args.class_name)
+    budget = None
+    if args.time_limit is not None or args.element_limit is not None or args.memory_limit is not None:
+        memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit is not None else None
+        budget = Budget(args.time_limit, args.element_limit, memory_limit)
+    reasoner = ELReasoner(ontology, budget=budget)
+
+    if args.class_name:
+        try:
+            subsumers = reasoner.compute_subsumers(args.class_name)
+        except AmbiguousClassName as e:
+            parser.error(str(e))
 
-    for subsumer in subsumers:
-        print(subsumer)
+        for subsumer in subsumers:
+            print(subsumer)
+        print_cutoff(reasoner)
+    else:
+        print(f"Loaded {args.ontology_file} in {time.perf_counter() - start_time:.3f} seconds", file=sys.stderr)
+        if args.all:
+            run_batch(reasoner, reasoner.compute_all_classes(), args.format)
+        elif args.classes_file == "-":
+            run_batch(reasoner, read_class_names(sys.stdin), args.format)
+        else:
+            with open(args.classes_file) as f:
+                run_batch(reasoner, read_class_names(f), args.format)
@@ -0,0 +1,43 @@
+import math
+import time
+
+import numpy as np
+
+REASONER_NAMES = ("ELReasoner", "ELK", "HermiT")
+
+
+def elapsed_seconds(start_ns):
+    return (time.perf_counter_ns() - start_ns) / 1e9
+
+
+# Call function(*args) and store its duration in seconds as phases[name]
+def timed(phases, name, function, *args):
+    start_ns = time.perf_counter_ns()
+    value = function(*args)
+    phases[name] = elapsed_seconds(start_ns)
+    return value
+
+
+def percentiles(times):
+    if not times:
+        return {"median": math.nan, "p95": math.nan, "p99": math.nan}
+    median, p95, p99 = np.percentile(times, [50, 95, 99])
+    return {"median": float(median), "p95": float(p95), "p99": float(p99)}
+
+
+# Benchmark one class: run process_class warmup times without recording anything
+# (first-call effects such as lazy loading), then repeat times. The result of the
+# last run is returned with the repeat samples of every reasoner and their median
+# as execution_time.
+def benchmark_class(reasoner, warmup, repeat):
+    for _ in range(warmup):
+        reasoner.process_class()
+    samples = {reasoner_name: [] for reasoner_name in REASONER_NAMES}
+    for _ in range(repeat):
+        result, *times = reasoner.process_class()
+        for reasoner_name, time_elapsed in zip(REASONER_NAMES, times):
+            samples[reasoner_name].append(time_elapsed)
+    for reasoner_name in REASONER_NAMES:
+        result[reasoner_name]["execution_time"] = float(np.median(samples[reasoner_name]))
+        result[reasoner_name]["samples"] = samples[reasoner_name]
+    return result
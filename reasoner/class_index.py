@@ -0,0 +1,53 @@
+# Raised when a short name or label matches more than one class
+class AmbiguousClassName(LookupError):
+    def __init__(self, name, candidates):
+        self.name = name
+        self.candidates = candidates
+        super().__init__(f"'{name}' matches {len(candidates)} classes: {', '.join(sorted(candidates))}")
+
+
+# Name -> class index built once per loaded ontology, replacing the wildcard
+# search_one(iri="*" + class_name) per lookup. It holds the classes of the
+# ontology and of every ontology it imports, directly or not. A class can be looked
+# up by its full IRI, its fragment name or one of its labels, in that order. Short
+# names and labels that belong to several classes are never resolved silently.
+class ClassIndex:
+    def __init__(self, ontology):
+        self.ontology = ontology
+        self.by_iri = {}
+        self.by_name = {}
+        self.by_label = {}
+        for indexed_ontology in ontology.indirectly_imported_ontologies():
+            for cls in indexed_ontology.classes():
+                self.add(cls)
+
+    def add(self, cls):
+        if cls.iri in self.by_iri:
+            return
+        self.by_iri[cls.iri] = cls
+        self.by_name.setdefault(cls.name, []).append(cls)
+        for label in cls.label:
+            self.by_label.setdefault(str(label), []).append(cls)
+
+    # Class for an IRI, fragment name or label. Returns None when nothing matches and
+    # raises AmbiguousClassName when the name is shared by several classes.
+    def lookup(self, name):
+        cls = self.by_iri.get(name)
+        if cls is not None:
+            return cls
+        for index in (self.by_name, self.by_label):
+            candidates = index.get(name)
+            if candidates:
+                if len(candidates) > 1:
+                    raise AmbiguousClassName(name, [candidate.iri for candidate in candidates])
+                return candidates[0]
+        return None
+
+    # Shortest name that lookup() resolves back to this class
+    def unique_name(self, cls):
+        if len(self.by_name.get(cls.name, ())) == 1:
+            return cls.name
+        return cls.iri
+
+    def __len__(self):
+        return len(self.by_iri)
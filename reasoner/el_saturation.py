@@ -0,0 +1,510 @@
+import os
+import sys
+import time
+from collections import deque
+
+from el_tbox import TOP
+
+RULES = ("top", "subclass", "conjunction", "existential", "role_successor", "role_inclusion")
+
+
+# Counters of an instrumented saturation: for every rule how often it fired (one
+# firing per axiom it was applied with), how many new facts it derived and the time
+# spent in it; the number of fixpoint rounds (a round ends once every fact that was
+# queued when it started has been processed) and the largest number of elements
+class RuleStats:
+    def __init__(self):
+        self.firings = dict.fromkeys(RULES, 0)
+        self.derivations = dict.fromkeys(RULES, 0)
+        self.time = dict.fromkeys(RULES, 0.0)
+        self.rounds = 0
+        self.peak_elements = 0
+
+    def as_dict(self):
+        return {
+            "rules": {rule: {"firings": self.firings[rule], "derivations": self.derivations[rule], "time": self.time[rule]}
+                      for rule in RULES},
+            "rounds": self.rounds,
+            "peak_elements": self.peak_elements,
+        }
+
+
+# Resident memory of this process in bytes (the peak where /proc is not available)
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Limits for saturation runs: seconds since start(), number of model elements the
+# runs create after start() (not counting the root elements of the classes they
+# were started for) and resident memory of the process in bytes (None: no limit).
+# They are checked every check_interval processed facts, a run that exceeds one
+# stops with the facts still queued (see Saturation.run()).
+class Budget:
+    def __init__(self, time_limit=None, max_elements=None, memory_limit=None, check_interval=1024):
+        self.time_limit = time_limit
+        self.max_elements = max_elements
+        self.memory_limit = memory_limit
+        self.check_interval = check_interval
+        self.deadline = None
+        # saturation.elements_created at the first check after start()
+        self.start_elements = None
+
+    def start(self):
+        if self.time_limit is not None:
+            self.deadline = time.perf_counter() + self.time_limit
+        self.start_elements = None
+        return self
+
+    # The limit the saturation is over ("time", "elements" or "memory"), or None
+    def exceeded(self, saturation):
+        if self.start_elements is None:
+            self.start_elements = saturation.elements_created
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return "time"
+        if self.max_elements is not None and saturation.elements_created - self.start_elements > self.max_elements:
+            return "elements"
+        if self.memory_limit is not None and resident_memory() > self.memory_limit:
+            return "memory"
+        return None
+
+
+# EL completion over a CompiledTBox. Elements are integers, every element has a
+# label (set of concept IDs) and role edges to successor elements. Only newly
+# derived facts are put on the queue, and each one only looks at the axioms
+# indexed under the concept it derived.
+#
+# With shared_successors (the default) the successor for ∃r.A is the one element
+# whose root concept is A, as in the standard EL completion algorithm, so the model
+# never has more elements than there are distinct roots and fillers. Without it
+# every distinct (r, A) gets its own successor element.
+class Saturation:
+    def __init__(self, tbox, shared_successors=True, stats=None):
+        self.tbox = tbox
+        self.shared_successors = shared_successors
+        # Number of elements created so far, to watch the model size
+        self.elements_created = 0
+        self.labels = []
+        # successors[element][role] and predecessors[element][role] are sets of elements
+        self.successors = []
+        self.predecessors = []
+        # concept ID -> element that has it as its root concept
+        self.root_elements = {}
+        # (role, filler) -> successor element for ∃role.filler, without shared_successors
+        self.successor_elements = {}
+        # New (element, concept, expand_told) facts and new (element, role, successor) edges
+        self.queue = deque()
+        self.edge_queue = deque()
+        # Elements whose label grew, collected while not None
+        self.changed_elements = None
+        # Number of new facts (label entries and edges) derived so far
+        self.derived = 0
+        # RuleStats, when instrumented
+        self.stats = stats
+        # Limit that stopped the last run() before the fixpoint, None when it was reached
+        self.cutoff = None
+        # tbox.roles_version the edges were processed with
+        self.roles_version = tbox.roles_version
+
+    def new_element(self, concept_id):
+        element = len(self.labels)
+        self.elements_created += 1
+        self.labels.append(self.new_label())
+        self.successors.append({})
+        self.predecessors.append({})
+        self.derive(element, concept_id)
+        # T rule
+        self.derive(element, TOP)
+        if self.stats is not None:
+            self.stats.firings["top"] += 1
+            self.stats.derivations["top"] += 1
+            # Counted for the T rule, not for the rule that created the element
+            self.derived -= 1
+        return element
+
+    def new_label(self):
+        return set()
+
+    def add_root(self, concept_id):
+        element = self.root_elements.get(concept_id)
+        if element is None:
+            element = self.new_element(concept_id)
+            self.root_elements[concept_id] = element
+        return element
+
+    def successor_element(self, role_id, filler_id):
+        if self.shared_successors:
+            return self.add_root(filler_id)
+        element = self.successor_elements.get((role_id, filler_id))
+        if element is None:
+            element = self.new_element(filler_id)
+            self.successor_elements[(role_id, filler_id)] = element
+        return element
+
+    def derive(self, element, concept_id):
+        label = self.labels[element]
+        if concept_id not in label:
+            label.add(concept_id)
+            self.derived += 1
+            self.queue.append((element, concept_id, True))
+            if self.changed_elements is not None:
+                self.changed_elements.add(element)
+
+    def add_edge(self, element, role_id, successor):
+        successors = self.successors[element].setdefault(role_id, set())
+        if successor not in successors:
+            successors.add(successor)
+            self.derived += 1
+            self.predecessors[successor].setdefault(role_id, set()).add(element)
+            self.edge_queue.append((element, role_id, successor))
+
+    # New edge element -role-> successor: ∃role.A ⊑ B for every A of the successor
+    def edge_rule(self, element, role_id, successor):
+        existential_fillers = self.tbox.existential_fillers
+        firings = 0
+        for concept_id in list(self.labels[successor]):
+            for result in existential_fillers[concept_id].get(role_id, ()):
+                self.derive(element, result)
+                firings += 1
+        return firings
+
+    # Subclass rule: the whole told closure of A at once. Concepts added this way are
+    # only queued when some other rule is indexed under them, and without expanding
+    # their told subsumers again.
+    def subclass_rule(self, element, concept_id):
+        tbox = self.tbox
+        label = self.labels[element]
+        firings = 0
+        for super_id in tbox.told_closure(concept_id):
+            firings += 1
+            if super_id not in label:
+                label.add(super_id)
+                self.derived += 1
+                if tbox.has_rules(super_id):
+                    self.queue.append((element, super_id, False))
+                if self.changed_elements is not None:
+                    self.changed_elements.add(element)
+        return firings
+
+    # Conjunction rule: A ⊓ A2 ⊑ B
+    def conjunction_rule(self, element, concept_id):
+        label = self.labels[element]
+        firings = 0
+        for other_id, result in self.tbox.conjunctions[concept_id]:
+            if other_id in label:
+                self.derive(element, result)
+                firings += 1
+        return firings
+
+    # Existential introduction: A ⊑ ∃r.B
+    def existential_rule(self, element, concept_id):
+        firings = 0
+        for role_id, filler_id in self.tbox.existentials[concept_id]:
+            self.add_edge(element, role_id, self.successor_element(role_id, filler_id))
+            firings += 1
+        return firings
+
+    # Role inclusion rules for a new edge element -role-> successor: r ⊑ s adds the
+    # edges of all super roles at once, r∘s ⊑ t joins the edge with the edges after
+    # it (role as r) and before it (role as s)
+    def role_rule(self, element, role_id, successor):
+        tbox = self.tbox
+        firings = 0
+        for super_role_id in tbox.super_roles[role_id]:
+            self.add_edge(element, super_role_id, successor)
+            firings += 1
+        for second_id, result_id in tbox.chains_by_first[role_id]:
+            for next_successor in list(self.successors[successor].get(second_id, ())):
+                self.add_edge(element, result_id, next_successor)
+                firings += 1
+        for first_id, result_id in tbox.chains_by_second[role_id]:
+            for predecessor in list(self.predecessors[element].get(first_id, ())):
+                self.add_edge(predecessor, result_id, successor)
+                firings += 1
+        return firings
+
+    # When the role tables changed, every edge is processed again: super roles and
+    # chains that were left out before may lead to new edges now
+    def update_roles(self):
+        if self.roles_version != self.tbox.roles_version:
+            self.roles_version = self.tbox.roles_version
+            for element, successors in enumerate(self.successors):
+                for role_id, role_successors in successors.items():
+                    for successor in role_successors:
+                        self.edge_queue.append((element, role_id, successor))
+
+    # Role successor rule, seen from the successor side: ∃r.A ⊑ B
+    def role_successor_rule(self, element, concept_id):
+        fillers = self.tbox.existential_fillers[concept_id]
+        firings = 0
+        if fillers:
+            for role_id, predecessors in self.predecessors[element].items():
+                for result in fillers.get(role_id, ()):
+                    for predecessor in list(predecessors):
+                        self.derive(predecessor, result)
+                        firings += 1
+        return firings
+
+    # Apply the rules until nothing new is derived. With a started Budget the run
+    # stops once it is over a limit: the labels then hold sound but possibly not all
+    # subsumers, and the next run() continues from the queued facts. Returns whether
+    # the fixpoint was reached.
+    def run(self, budget=None):
+        self.cutoff = None
+        self.update_roles()
+        if self.stats is not None:
+            return self.run_instrumented(budget)
+        queue = self.queue
+        edge_queue = self.edge_queue
+        steps = 0
+        while queue or edge_queue:
+            if budget is not None:
+                if steps % budget.check_interval == 0 and self.over_budget(budget):
+                    return False
+                steps += 1
+            if edge_queue:
+                edge = edge_queue.popleft()
+                self.edge_rule(*edge)
+                self.role_rule(*edge)
+                continue
+
+            element, concept_id, expand_told = queue.popleft()
+            if expand_told:
+                self.subclass_rule(element, concept_id)
+            self.conjunction_rule(element, concept_id)
+            self.existential_rule(element, concept_id)
+            self.role_successor_rule(element, concept_id)
+        return True
+
+    def over_budget(self, budget):
+        self.cutoff = budget.exceeded(self)
+        return self.cutoff is not None
+
+    # run() with every rule application counted and timed into self.stats
+    def run_instrumented(self, budget=None):
+        stats = self.stats
+        queue = self.queue
+        edge_queue = self.edge_queue
+
+        def apply(rule_name, rule, *fact):
+            derived = self.derived
+            start_time = time.perf_counter()
+            stats.firings[rule_name] += rule(*fact)
+            stats.time[rule_name] += time.perf_counter() - start_time
+            stats.derivations[rule_name] += self.derived - derived
+
+        round_left = 0
+        steps = 0
+        while queue or edge_queue:
+            if budget is not None:
+                if steps % budget.check_interval == 0 and self.over_budget(budget):
+                    break
+                steps += 1
+            if round_left == 0:
+                stats.rounds += 1
+                round_left = len(queue) + len(edge_queue)
+            round_left -= 1
+
+            if edge_queue:
+                # The role successor and role inclusion rules, for a new edge
+                edge = edge_queue.popleft()
+                apply("role_successor", self.edge_rule, *edge)
+                apply("role_inclusion", self.role_rule, *edge)
+                continue
+
+            element, concept_id, expand_told = queue.popleft()
+            if expand_told:
+                apply("subclass", self.subclass_rule, element, concept_id)
+            apply("conjunction", self.conjunction_rule, element, concept_id)
+            apply("existential", self.existential_rule, element, concept_id)
+            apply("role_successor", self.role_successor_rule, element, concept_id)
+        stats.peak_elements = max(stats.peak_elements, len(self.labels))
+        return self.cutoff is None
+
+    # run(), but only until every concept in goals[element] is in the label of its
+    # element, or until it is over a started budget. The facts still queued then stay
+    # queued for the next run(). Returns whether all goals were reached.
+    def run_until(self, goals, budget=None):
+        self.cutoff = None
+        goals = {element: set(concept_ids) for element, concept_ids in goals.items()}
+        self.update_roles()
+        for element in list(goals):
+            self.check_goals(goals, element)
+        queue = self.queue
+        edge_queue = self.edge_queue
+        steps = 0
+        while goals and (queue or edge_queue):
+            if budget is not None:
+                if steps % budget.check_interval == 0 and self.over_budget(budget):
+                    return False
+                steps += 1
+            if edge_queue:
+                edge = edge_queue.popleft()
+                self.edge_rule(*edge)
+                self.role_rule(*edge)
+                continue
+
+            element, concept_id, expand_told = queue.popleft()
+            if expand_told:
+                self.subclass_rule(element, concept_id)
+            self.conjunction_rule(element, concept_id)
+            self.existential_rule(element, concept_id)
+            self.role_successor_rule(element, concept_id)
+            # Every derivation for an element is queued for it, or made while one of
+            # its facts is processed, so its goals only need checking here
+            if element in goals:
+                self.check_goals(goals, element)
+        return not goals
+
+    def check_goals(self, goals, element):
+        goals[element] = {concept_id for concept_id in goals[element] if not self.has_concept(element, concept_id)}
+        if not goals[element]:
+            del goals[element]
+
+    def has_concept(self, element, concept_id):
+        return concept_id in self.labels[element]
+
+    # Fire the rules of the given concepts again for every element that has them,
+    # after new axioms were indexed under them
+    def refire(self, concept_ids):
+        concept_ids = set(concept_ids)
+        for element, label in enumerate(self.labels):
+            for concept_id in concept_ids & label:
+                self.queue.append((element, concept_id, True))
+
+    # Named subsumers of a root element, as concept IDs
+    def subsumer_ids(self, element):
+        return self.labels[element] & self.tbox.named
+
+
+# Concept IDs of the bits set in mask, lowest first
+def bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+# Saturation with every label stored as an int bitset (bit i set for concept ID i)
+# instead of a set. Membership is a bit test, the subclass rule adds the bitmask of
+# the whole told closure with one OR and only the bits that are new are looked at.
+# The edge rule only looks at the bits of concepts with an ∃r.A ⊑ B axiom for the
+# role, and the conjunction rule at the bits of the other conjuncts of A, through
+# masks that are rebuilt when the rule indexes change. Bit tests on a Python int
+# cost time linear in its size, so single bits are never tested one by one.
+class BitsetSaturation(Saturation):
+    def __init__(self, tbox, shared_successors=True, stats=None):
+        super().__init__(tbox, shared_successors, stats)
+        # Named concepts, concepts with has_rules() and, per role, concepts with
+        # ∃role.A ⊑ B axioms, for the TBox at masks_version and masks_size
+        self.named_mask = 0
+        self.rules_mask = 0
+        self.filler_masks = {}
+        # Concept ID -> (mask of the other conjuncts, {other conjunct: [results]})
+        self.conjunction_masks = {}
+        self.masks_version = None
+        self.masks_size = None
+
+    def new_label(self):
+        return 0
+
+    def update_masks(self):
+        tbox = self.tbox
+        if self.masks_version == tbox.rules_version and self.masks_size == tbox.concept_count:
+            return
+        self.named_mask = 0
+        self.rules_mask = 0
+        self.filler_masks = {}
+        self.conjunction_masks = {}
+        for concept_id in range(tbox.concept_count):
+            if concept_id in tbox.named:
+                self.named_mask |= 1 << concept_id
+            if tbox.has_rules(concept_id):
+                self.rules_mask |= 1 << concept_id
+            for role_id in tbox.existential_fillers[concept_id]:
+                self.filler_masks[role_id] = self.filler_masks.get(role_id, 0) | 1 << concept_id
+        self.masks_version = tbox.rules_version
+        self.masks_size = tbox.concept_count
+
+    def derive(self, element, concept_id):
+        label = self.labels[element]
+        bit = 1 << concept_id
+        if not label & bit:
+            self.labels[element] = label | bit
+            self.derived += 1
+            self.queue.append((element, concept_id, True))
+            if self.changed_elements is not None:
+                self.changed_elements.add(element)
+
+    def edge_rule(self, element, role_id, successor):
+        existential_fillers = self.tbox.existential_fillers
+        firings = 0
+        for concept_id in bits(self.labels[successor] & self.filler_masks.get(role_id, 0)):
+            for result in existential_fillers[concept_id][role_id]:
+                self.derive(element, result)
+                firings += 1
+        return firings
+
+    def subclass_rule(self, element, concept_id):
+        label = self.labels[element]
+        closure = self.tbox.told_closure_mask(concept_id)
+        new = closure & ~label
+        if new:
+            self.labels[element] = label | new
+            self.derived += new.bit_count()
+            for super_id in bits(new & self.rules_mask):
+                self.queue.append((element, super_id, False))
+            if self.changed_elements is not None:
+                self.changed_elements.add(element)
+        return closure.bit_count()
+
+    def conjunction_mask(self, concept_id):
+        entry = self.conjunction_masks.get(concept_id)
+        if entry is None:
+            mask = 0
+            results = {}
+            for other_id, result in self.tbox.conjunctions[concept_id]:
+                mask |= 1 << other_id
+                results.setdefault(other_id, []).append(result)
+            entry = self.conjunction_masks[concept_id] = (mask, results)
+        return entry
+
+    def conjunction_rule(self, element, concept_id):
+        if not self.tbox.conjunctions[concept_id]:
+            return 0
+        mask, results = self.conjunction_mask(concept_id)
+        firings = 0
+        for other_id in bits(self.labels[element] & mask):
+            for result in results[other_id]:
+                self.derive(element, result)
+                firings += 1
+        return firings
+
+    def run(self, budget=None):
+        self.update_masks()
+        return super().run(budget)
+
+    def run_until(self, goals, budget=None):
+        self.update_masks()
+        return super().run_until(goals, budget)
+
+    def refire(self, concept_ids):
+        mask = 0
+        for concept_id in concept_ids:
+            mask |= 1 << concept_id
+        for element, label in enumerate(self.labels):
+            for concept_id in bits(label & mask):
+                self.queue.append((element, concept_id, True))
+
+    def has_concept(self, element, concept_id):
+        return bool(self.labels[element] >> concept_id & 1)
+
+    def subsumer_ids(self, element):
+        self.update_masks()
+        return set(bits(self.labels[element] & self.named_mask))
@@ -0,0 +1,439 @@
+from owlready2 import SOME, And, ObjectProperty, ObjectPropertyClass, Restriction, Thing, ThingClass, TransitiveProperty
+
+from memo_cache import MemoCache
+
+# Concept 0 is always owl:Thing
+TOP = 0
+
+NOT_CACHED = object()
+
+
+# The ontology compiled once into EL normal form. Every concept (named or complex)
+# and every role gets an integer ID and the axioms are stored as per-concept
+# indexes of what fires when that concept is derived for an element:
+#
+#   told_subsumers[A]       A ⊑ B                 -> [B, ...]
+#   conjunctions[A]         A ⊓ A2 ⊑ B            -> [(A2, B), ...]
+#   existentials[A]         A ⊑ ∃r.B              -> [(r, B), ...]
+#   existential_fillers[A]  ∃r.A ⊑ B              -> {r: [B, ...]}
+#
+# Complex concepts get an auxiliary ID that is defined in both directions, so an
+# occurrence on either side of an axiom is covered. Constructs outside EL (or,
+# not, only, value, cardinalities, inverse roles, ...) are skipped.
+#
+# Role inclusions r ⊑ s and role chains r∘s ⊑ t (transitive roles as r∘r ⊑ r,
+# longer chains split with auxiliary roles) are compiled into per-role tables,
+# rebuilt whenever they change. The tables only lead to roles whose edges can
+# derive something: the roles of ∃r.A ⊑ B axioms, and the roles that imply them
+# through inclusions and chains.
+#
+#   super_roles[r]          r ⊑ s, transitively   -> (s, ...)
+#   chains_by_first[r]      r∘s ⊑ t               -> [(s, t), ...]
+#   chains_by_second[s]     r∘s ⊑ t               -> [(r, t), ...]
+#
+# Memo caches (optionally bounded by cache_size) keep repeated work to one
+# computation per ontology: the transitive closure of the told subsumers of a
+# concept (also as a bitmask of concept IDs), and the ID of an owlready2
+# conjunction or ∃r.C construct.
+class CompiledTBox:
+    def __init__(self, cache_size=None):
+        # ID -> owlready2 object for named classes and roles, ID -> structural key for
+        # complex concepts
+        self.concepts = []
+        self.concept_ids = {}
+        self.roles = []
+        self.role_ids = {}
+        # IDs of the named classes
+        self.named = set()
+        # Told role inclusions (role -> [super role, ...]) and (r, s, t) for r∘s ⊑ t,
+        # and the tables built from them by update_role_tables()
+        self.told_super_roles = []
+        self.role_chains = []
+        self.super_roles = []
+        self.chains_by_first = []
+        self.chains_by_second = []
+        # Roles of ∃r.A ⊑ B axioms when the tables were built
+        self.filler_roles = set()
+        self.roles_changed = False
+        # Bumped whenever the role tables are rebuilt
+        self.roles_version = 0
+
+        self.told_subsumers = []
+        self.conjunctions = []
+        self.existentials = []
+        self.existential_fillers = []
+
+        self.closure_cache = MemoCache(cache_size)
+        # Told closures (sets) of concepts 0 .. len - 1, computed at once by
+        # precompute_told_closures(); None for the concepts it leaves out
+        self.told_closures = []
+        # told_closure() calls answered from told_closures, which bypass closure_cache
+        self.precomputed_hits = 0
+        self.closure_mask_cache = MemoCache(cache_size)
+        self.construct_cache = MemoCache(cache_size)
+
+        # Concepts whose indexes got new entries, for incremental reasoning
+        self.touched = set()
+        # Bumped whenever conjunctions, existentials or existential_fillers get an entry
+        self.rules_version = 0
+
+        # Named classes and roles whose own axioms still have to be compiled
+        self.pending_classes = []
+        self.pending_roles = []
+        self.intern_concept(Thing)
+
+    @property
+    def concept_count(self):
+        return len(self.concepts)
+
+    def new_concept(self, key):
+        concept_id = len(self.concepts)
+        self.concepts.append(key)
+        self.concept_ids[key] = concept_id
+        self.told_subsumers.append([])
+        self.conjunctions.append([])
+        self.existentials.append([])
+        self.existential_fillers.append({})
+        return concept_id
+
+    def new_role(self, key):
+        role_id = len(self.roles)
+        self.roles.append(key)
+        self.role_ids[key] = role_id
+        self.told_super_roles.append([])
+        self.super_roles.append(())
+        self.chains_by_first.append([])
+        self.chains_by_second.append([])
+        return role_id
+
+    def intern_role(self, role):
+        if not isinstance(role, ObjectPropertyClass) or role is ObjectProperty:
+            return None
+        role_id = self.role_ids.get(role)
+        if role_id is None:
+            role_id = self.new_role(role)
+            self.pending_roles.append(role)
+        return role_id
+
+    def add_super_role(self, role_id, super_role_id):
+        if super_role_id != role_id and super_role_id not in self.told_super_roles[role_id]:
+            self.told_super_roles[role_id].append(super_role_id)
+            self.roles_changed = True
+
+    # r1∘...∘rn ⊑ result as binary chains: (r1∘r2)∘r3 ... through auxiliary roles
+    def add_role_chain(self, role_ids, result_id):
+        if len(role_ids) == 1:
+            self.add_super_role(role_ids[0], result_id)
+            return
+        first_id = role_ids[0]
+        for second_id in role_ids[1:-1]:
+            key = ("chain", first_id, second_id)
+            chain_id = self.role_ids.get(key)
+            if chain_id is None:
+                chain_id = self.new_role(key)
+                self.role_chains.append((first_id, second_id, chain_id))
+                self.roles_changed = True
+            first_id = chain_id
+        chain = (first_id, role_ids[-1], result_id)
+        if chain not in self.role_chains:
+            self.role_chains.append(chain)
+            self.roles_changed = True
+
+    def compile_role(self, role):
+        role_id = self.role_ids[role]
+        for parent in list(role.is_a) + list(role.equivalent_to):
+            super_role_id = self.intern_role(parent)
+            if super_role_id is not None:
+                self.add_super_role(role_id, super_role_id)
+        for equivalent in role.equivalent_to:
+            equivalent_id = self.intern_role(equivalent)
+            if equivalent_id is not None:
+                self.add_super_role(equivalent_id, role_id)
+        if TransitiveProperty in role.is_a:
+            self.add_role_chain((role_id, role_id), role_id)
+        try:
+            chains = [list(chain.properties) for chain in role.property_chain]
+        except TypeError:
+            # owlready2 fails on chains whose list it cannot parse (e.g. a world
+            # shared by several ontologies); they are left out
+            chains = []
+        for chain in chains:
+            role_ids = [self.intern_role(part) for part in chain]
+            if role_ids and None not in role_ids:
+                self.add_role_chain(role_ids, role_id)
+
+    # Rebuild the role tables, so the saturation finds the super roles and chains of
+    # a new edge by role ID
+    def update_role_tables(self):
+        count = len(self.roles)
+        super_roles = []
+        for role_id in range(count):
+            seen = set()
+            stack = [role_id]
+            while stack:
+                for super_role_id in self.told_super_roles[stack.pop()]:
+                    if super_role_id not in seen:
+                        seen.add(super_role_id)
+                        stack.append(super_role_id)
+            seen.discard(role_id)
+            super_roles.append(seen)
+
+        self.filler_roles = {role_id for fillers in self.existential_fillers for role_id in fillers}
+        relevant = set(self.filler_roles)
+        changed = True
+        while changed:
+            size = len(relevant)
+            relevant.update(role_id for role_id in range(count) if super_roles[role_id] & relevant)
+            for first_id, second_id, result_id in self.role_chains:
+                if result_id in relevant:
+                    relevant.update((first_id, second_id))
+            changed = len(relevant) != size
+
+        chains_by_first = [[] for _ in range(count)]
+        chains_by_second = [[] for _ in range(count)]
+        for first_id, second_id, result_id in self.role_chains:
+            if result_id in relevant:
+                chains_by_first[first_id].append((second_id, result_id))
+                chains_by_second[second_id].append((first_id, result_id))
+        self.super_roles = [tuple(seen & relevant) for seen in super_roles]
+        self.chains_by_first = chains_by_first
+        self.chains_by_second = chains_by_second
+        self.roles_changed = False
+        self.roles_version += 1
+
+    # ID of a concept, compiling it on first sight. Returns None for non-EL concepts.
+    def intern_concept(self, concept):
+        concept_id = self.concept_ids.get(concept)
+        if concept_id is not None:
+            return concept_id
+
+        if isinstance(concept, ThingClass):
+            concept_id = self.new_concept(concept)
+            if concept is Thing:
+                return concept_id
+            self.named.add(concept_id)
+            self.pending_classes.append(concept)
+            return concept_id
+
+        if isinstance(concept, And) or (isinstance(concept, Restriction) and concept.type == SOME):
+            concept_id = self.construct_cache.get(concept, NOT_CACHED)
+            if concept_id is NOT_CACHED:
+                concept_id = self.intern_construct(concept)
+                self.construct_cache.put(concept, concept_id)
+            return concept_id
+
+        return None
+
+    def intern_construct(self, concept):
+        if isinstance(concept, And):
+            parts = [self.intern_concept(part) for part in concept.Classes]
+            if None in parts:
+                return None
+            return self.intern_conjunction(parts)
+
+        role_id = self.intern_role(concept.property)
+        filler_id = self.intern_concept(concept.value)
+        if role_id is None or filler_id is None:
+            return None
+        return self.intern_existential(role_id, filler_id)
+
+    # Binary conjunctions: (A1 ⊓ ... ⊓ An-1) ⊓ An ⊑ X and X ⊑ Ai
+    def intern_conjunction(self, parts):
+        parts = tuple(sorted(set(parts)))
+        if len(parts) == 1:
+            return parts[0]
+        key = ('and', parts)
+        concept_id = self.concept_ids.get(key)
+        if concept_id is None:
+            concept_id = self.new_concept(key)
+            self.told_subsumers[concept_id].extend(parts)
+            rest = self.intern_conjunction(parts[:-1])
+            self.add_conjunction(rest, parts[-1], concept_id)
+        return concept_id
+
+    # X ⊑ ∃r.A and ∃r.A ⊑ X
+    def intern_existential(self, role_id, filler_id):
+        key = ('some', role_id, filler_id)
+        concept_id = self.concept_ids.get(key)
+        if concept_id is None:
+            concept_id = self.new_concept(key)
+            self.existentials[concept_id].append((role_id, filler_id))
+            self.existential_fillers[filler_id].setdefault(role_id, []).append(concept_id)
+            self.touched.add(filler_id)
+            self.rules_version += 1
+            if role_id not in self.filler_roles:
+                self.roles_changed = True
+        return concept_id
+
+    def add_conjunction(self, first, second, result):
+        self.conjunctions[first].append((second, result))
+        if first != second:
+            self.conjunctions[second].append((first, result))
+        self.touched.update((first, second))
+        self.rules_version += 1
+
+    # Add sub ⊑ concept, splitting conjunctions and existentials on the right-hand side
+    # so they need no auxiliary concept
+    def add_subsumption(self, sub_id, concept):
+        if isinstance(concept, And):
+            for part in concept.Classes:
+                self.add_subsumption(sub_id, part)
+        elif isinstance(concept, Restriction) and concept.type == SOME:
+            role_id = self.intern_role(concept.property)
+            filler_id = self.intern_concept(concept.value)
+            if role_id is not None and filler_id is not None:
+                if (role_id, filler_id) not in self.existentials[sub_id]:
+                    self.existentials[sub_id].append((role_id, filler_id))
+                    self.touched.add(sub_id)
+                    self.rules_version += 1
+        else:
+            super_id = self.intern_concept(concept)
+            if super_id is not None and super_id != sub_id and super_id not in self.told_subsumers[sub_id]:
+                self.told_subsumers[sub_id].append(super_id)
+                self.touched.add(sub_id)
+
+    def compile_class(self, cls):
+        class_id = self.concept_ids[cls]
+        for parent in cls.is_a:
+            self.add_subsumption(class_id, parent)
+        for equivalent in cls.equivalent_to:
+            self.add_subsumption(class_id, equivalent)
+            equivalent_id = self.intern_concept(equivalent)
+            if equivalent_id is not None and equivalent_id != class_id and class_id not in self.told_subsumers[equivalent_id]:
+                self.told_subsumers[equivalent_id].append(class_id)
+                self.touched.add(equivalent_id)
+
+    # Add sub ⊑ sup for owlready2 concepts given after compilation. Returns False when
+    # the left-hand side is not an EL concept.
+    def add_axiom(self, sub, sup):
+        sub_id = self.intern_concept(sub)
+        if sub_id is None:
+            return False
+        self.add_subsumption(sub_id, sup)
+        self.clear_closures()
+        self.compile_pending()
+        return True
+
+    def compile_pending(self):
+        if self.pending_classes:
+            # New told axioms can extend closures computed so far
+            self.clear_closures()
+        while self.pending_classes or self.pending_roles:
+            if self.pending_roles:
+                self.compile_role(self.pending_roles.pop())
+            else:
+                self.compile_class(self.pending_classes.pop())
+        if self.roles_changed:
+            self.update_role_tables()
+
+    def clear_closures(self):
+        self.closure_cache.clear()
+        self.told_closures = []
+        self.closure_mask_cache.clear()
+
+    # All told subsumers of a concept (transitively, without the concept itself).
+    # Closures already precomputed or in the cache are reused instead of walked again.
+    def told_closure(self, concept_id):
+        if concept_id < len(self.told_closures) and self.told_closures[concept_id] is not None:
+            self.precomputed_hits += 1
+            return self.told_closures[concept_id]
+        closure = self.closure_cache.get(concept_id)
+        if closure is None:
+            seen = set()
+            stack = [concept_id]
+            while stack:
+                for super_id in self.told_subsumers[stack.pop()]:
+                    if super_id not in seen:
+                        seen.add(super_id)
+                        known = self.told_closures[super_id] if super_id < len(self.told_closures) else None
+                        if known is None:
+                            known = self.closure_cache.entries.get(super_id)
+                        if known is None:
+                            stack.append(super_id)
+                        else:
+                            seen.update(known)
+            seen.discard(concept_id)
+            closure = tuple(seen)
+            self.closure_cache.put(concept_id, closure)
+        return closure
+
+    # Told closures of all concepts in one topological sweep over the told subsumer
+    # graph, from the top down: a concept is done once all of its told subsumers are,
+    # and its closure is the union of theirs. Concepts on or below a cycle (classes
+    # declared equivalent) are never ready and are left to told_closure().
+    def precompute_told_closures(self):
+        told_subsumers = self.told_subsumers
+        count = self.concept_count
+        waiting = [0] * count
+        sub_ids = [[] for _ in range(count)]
+        ready = []
+        for concept_id, super_ids in enumerate(told_subsumers):
+            waiting[concept_id] = len(super_ids)
+            if not super_ids:
+                ready.append(concept_id)
+            for super_id in super_ids:
+                sub_ids[super_id].append(concept_id)
+
+        told_closures = [None] * count
+        while ready:
+            concept_id = ready.pop()
+            super_ids = told_subsumers[concept_id]
+            if len(super_ids) == 1:
+                closure = told_closures[super_ids[0]] | {super_ids[0]}
+            else:
+                closure = set(super_ids)
+                for super_id in super_ids:
+                    closure |= told_closures[super_id]
+            told_closures[concept_id] = closure
+            for sub_id in sub_ids[concept_id]:
+                waiting[sub_id] -= 1
+                if not waiting[sub_id]:
+                    ready.append(sub_id)
+        self.told_closures = told_closures
+
+    # told_closure() as a bitmask, bit i set for concept ID i
+    def told_closure_mask(self, concept_id):
+        mask = self.closure_mask_cache.get(concept_id)
+        if mask is None:
+            mask = 0
+            for super_id in self.told_closure(concept_id):
+                mask |= 1 << super_id
+            self.closure_mask_cache.put(concept_id, mask)
+        return mask
+
+    # Whether deriving the concept can fire anything besides its told subsumers
+    def has_rules(self, concept_id):
+        return bool(self.conjunctions[concept_id] or self.existentials[concept_id] or self.existential_fillers[concept_id])
+
+    # Hit/miss counters of the caches; told closure hits on the precomputed closures
+    # are counted as precomputed_hits
+    def cache_stats(self):
+        closure_stats = dict(self.closure_cache.stats(), precomputed_hits=self.precomputed_hits)
+        return {"told_closure": closure_stats, "told_closure_mask": self.closure_mask_cache.stats(),
+                "constructs": self.construct_cache.stats()}
+
+    # ID of a named class, compiling its axioms if it was not part of the TBox yet
+    def add_class(self, cls):
+        class_id = self.intern_concept(cls)
+        self.compile_pending()
+        return class_id
+
+    def compile(self, ontology):
+        # Every named class reached while compiling (also through imports) gets its
+        # own axioms compiled
+        for cls in ontology.classes():
+            self.intern_concept(cls)
+        # Role chains are stored with the role they imply, so every role is compiled
+        for role in ontology.object_properties():
+            self.intern_role(role)
+        for axiom in ontology.general_class_axioms():
+            left_id = self.intern_concept(axiom.left_side)
+            if left_id is not None:
+                for parent in axiom.is_a:
+                    self.add_subsumption(left_id, parent)
+        self.compile_pending()
+        return self
+
+
+def compile_tbox(ontology, cache_size=None):
+    return CompiledTBox(cache_size).compile(ontology)
@@ -0,0 +1,146 @@
+import re
+import time
+
+# Wrappers that the JVM side may put around a concept name in toString()
+CONCEPT_NAME_PATTERN = re.compile(r'^ConceptName\((.*)\)$')
+TOP_NAMES = ("⊤", "TopConcept$", "TopConcept", "TOP")
+
+
+# Split a collection's toString() at top-level separators, ignoring the ones nested
+# inside brackets
+def split_top_level(text, separator=", "):
+    parts = []
+    depth = 0
+    start = 0
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif depth == 0 and text.startswith(separator, index):
+            parts.append(text[start:index])
+            index += len(separator)
+            start = index
+            continue
+        index += 1
+    if text[start:]:
+        parts.append(text[start:])
+    return parts
+
+
+# Strip "{...}", "[...]", "Map(...)", "Set(...)" and friends around a collection
+def strip_collection(text):
+    text = text.strip()
+    if text[:1] in "[{" and text[-1:] in "]}":
+        return text[1:-1]
+    match = re.match(r'^\w*(Map|Set|List)\((.*)\)$', text, re.S)
+    if match:
+        return match.group(2)
+    return None
+
+
+def parse_map(text):
+    body = strip_collection(text)
+    if body is None:
+        return None
+    parsed = {}
+    for entry in split_top_level(body):
+        for separator in (" -> ", "="):
+            key_value = split_top_level(entry, separator)
+            if len(key_value) == 2:
+                break
+        else:
+            return None
+        values = strip_collection(key_value[1])
+        if values is None:
+            return None
+        parsed[key_value[0]] = split_top_level(values)
+    return parsed
+
+
+# All ELK subsumer sets of an ontology in a few py4j round trips: classify() once on
+# the Java side (timed as reasoning), then bring the whole classification over as one
+# string (timed as transfer) instead of getSubsumers/toArray/format per class.
+#
+# The string form of concepts is checked against SimpleDLFormatter on a sample of
+# classes first. When it does not match, or the map cannot be parsed, the result
+# is transferred entry by entry, formatting every distinct concept only once.
+class ELKBatch:
+    def __init__(self, reasoner_ELK, formatter, sample_size=5):
+        self.reasoner_ELK = reasoner_ELK
+        self.formatter = formatter
+        self.sample_size = sample_size
+        self.subsumers = {}
+        self.reasoning_time = 0.0
+        self.transfer_time = 0.0
+        self.round_trips = 0
+        self.bulk = False
+
+    def classify(self):
+        start_time = time.perf_counter()
+        classification = self.call(self.reasoner_ELK.classify)
+        self.reasoning_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        self.subsumers = self.transfer_bulk(classification)
+        self.bulk = self.subsumers is not None
+        if not self.bulk:
+            self.subsumers = self.transfer_entries(classification)
+        self.transfer_time = time.perf_counter() - start_time
+        return self.subsumers
+
+    def call(self, method, *args):
+        self.round_trips += 1
+        return method(*args)
+
+    # Items of a Java array, fetched one round trip each
+    def array_items(self, array):
+        return [self.call(array.__getitem__, index) for index in range(self.call(len, array))]
+
+    def normalize(self, raw):
+        raw = raw.strip()
+        if raw in TOP_NAMES:
+            return "⊤"
+        match = CONCEPT_NAME_PATTERN.match(raw)
+        return match.group(1) if match else raw
+
+    def transfer_bulk(self, classification):
+        keys = self.call(self.call(classification.keySet).toArray)
+        size = self.call(len, keys)
+        for index in range(min(self.sample_size, size)):
+            key = self.call(keys.__getitem__, index)
+            if self.normalize(self.call(key.toString)) != self.call(self.formatter.format, key):
+                return None
+
+        parsed = parse_map(self.call(classification.toString))
+        if parsed is None or len(parsed) != size:
+            return None
+        subsumers = {}
+        for key, values in parsed.items():
+            subsumers[self.normalize(key)] = [self.normalize(value) for value in values]
+        return subsumers
+
+    def transfer_entries(self, classification):
+        names = {}
+
+        def format_concept(concept):
+            raw = self.call(concept.toString)
+            if raw not in names:
+                names[raw] = self.call(self.formatter.format, concept)
+            return names[raw]
+
+        subsumers = {}
+        for entry in self.array_items(self.call(self.call(classification.entrySet).toArray)):
+            key = format_concept(self.call(entry.getKey))
+            values = self.array_items(self.call(self.call(entry.getValue).toArray))
+            subsumers[key] = [format_concept(concept) for concept in values]
+        return subsumers
+
+    # Subsumers of a class, as formatted by SimpleDLFormatter. ELK may quote names.
+    def get_subsumers(self, class_name):
+        subsumers = self.subsumers.get(class_name)
+        if subsumers is None:
+            subsumers = self.subsumers.get(f'"{class_name}"', [])
+        return subsumers
@@ -3,77 +3,417 @@ import glob
 import json
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import numpy as np
+from benchmark import REASONER_NAMES, benchmark_class, elapsed_seconds, percentiles, timed
+from class_index import ClassIndex
+from el_saturation import Budget
+from elk_batch import ELKBatch
 from G18_Reasoner import *
+from ontology_store import OntologyStore
 from owlready2 import *
 from py4j.java_gateway import JavaGateway
+from result_writer import (CompactEncoder, ResultWriter, RunningStats, compressed_path, dump_row, expand_results,
+                           finished_statistics, open_results, part_path, part_paths, read_results, repair, results_path)
 from tqdm import tqdm
 
 
 class Reasoner:
-    def __init__(self, class_name, reasoner_EL, reasoner_ELK, elFactory, formatter, args):
+    def __init__(self, class_name, reasoner_EL, reasoner_ELK, elFactory, formatter, class_index_HERMIT, args, elk_batch=None):
         self.class_name = class_name
         self.reasoner_EL = reasoner_EL
         self.reasoner_ELK = reasoner_ELK
         self.elFactory = elFactory
         self.formatter = formatter
+        self.class_index_HERMIT = class_index_HERMIT
         self.args = args
-
-    def calculate_stats(self, execution_times):
-        total_time = sum(execution_times)
-        avg_time = np.mean(execution_times)
-        std_dev = np.std(execution_times)
-        return total_time, avg_time, std_dev
+        self.elk_batch = elk_batch
 
     def process_class(self):
         result = {"class_name": self.class_name}
 
         # ELReasoner
-        start_time_EL = time.time()
+        start_time_EL = time.perf_counter_ns()
         subsumers_EL = self.reasoner_EL.compute_subsumers(self.class_name)
-        end_time_EL = time.time()
+        time_elapsed_EL = elapsed_seconds(start_time_EL)
 
         result["ELReasoner"] = {
             "subsumers": subsumers_EL,
             "count": len(subsumers_EL),
-            "execution_time": end_time_EL - start_time_EL,
+            "execution_time": time_elapsed_EL,
         }
+        # Stopped at a time, element or memory limit with the subsumers found so far
+        if self.reasoner_EL.cutoff is not None:
+            result["ELReasoner"]["incomplete"] = self.reasoner_EL.cutoff
         if self.args.verbose:
-            print(f"ELReasoner computed {len(subsumers_EL)} subsumers for class {self.class_name} in {end_time_EL - start_time_EL:.5f} seconds")
-
-        # ELK Reasoner
-        start_time_ELK = time.time()
-        class_name_ELK = self.elFactory.getConceptName(self.class_name)
-        subsumers_ELK = self.reasoner_ELK.getSubsumers(class_name_ELK)
-        end_time_ELK = time.time()
+            print(f"ELReasoner computed {len(subsumers_EL)} subsumers for class {self.class_name} in {time_elapsed_EL:.5f} seconds")
+
+        # ELK Reasoner. In batch mode the classification was transferred already and
+        # this is a lookup, like for the ELReasoner.
+        start_time_ELK = time.perf_counter_ns()
+        if self.elk_batch is not None:
+            subsumers_ELK = self.elk_batch.get_subsumers(self.class_name)
+        else:
+            class_name_ELK = self.elFactory.getConceptName(self.class_name)
+            subsumers_ELK = [self.formatter.format(concept) for concept in self.reasoner_ELK.getSubsumers(class_name_ELK).toArray()]
+        time_elapsed_ELK = elapsed_seconds(start_time_ELK)
 
         result["ELK"] = {
-            "subsumers": [self.formatter.format(concept) for concept in subsumers_ELK.toArray()],
+            "subsumers": subsumers_ELK,
             "count": len(subsumers_ELK),
-            "execution_time": end_time_ELK - start_time_ELK,
+            "execution_time": time_elapsed_ELK,
         }
         if self.args.verbose:
-            print(f"ELK computed {len(subsumers_ELK)} subsumers for class {self.class_name} in {end_time_ELK - start_time_ELK:.5f} seconds")
+            print(f"ELK computed {len(subsumers_ELK)} subsumers for class {self.class_name} in {time_elapsed_ELK:.5f} seconds")
 
         # HermiT Reasoner
-        start_time_HERMIT = time.time()
-        class_object_HERMIT = ontology_HERMIT.search_one(iri="*" + self.class_name)
+        start_time_HERMIT = time.perf_counter_ns()
+        class_object_HERMIT = self.class_index_HERMIT.lookup(self.class_name)
         subsumers_HERMIT = class_object_HERMIT.ancestors(include_self=True, include_constructs=False)
-        end_time_HERMIT = time.time()
+        time_elapsed_HERMIT = elapsed_seconds(start_time_HERMIT)
 
         result["HermiT"] = {
             "subsumers": [str(i) for i in subsumers_HERMIT],
             "count": len(subsumers_HERMIT),
-            "execution_time": end_time_HERMIT - start_time_HERMIT,
+            "execution_time": time_elapsed_HERMIT,
         }
         if self.args.verbose:
-            print(f"HermiT computed {len(subsumers_HERMIT)} subsumers for class {self.class_name} in {end_time_HERMIT - start_time_HERMIT:.5f} seconds")
+            print(f"HermiT computed {len(subsumers_HERMIT)} subsumers for class {self.class_name} in {time_elapsed_HERMIT:.5f} seconds")
 
         if self.args.verbose:
             print()
 
-        return result, end_time_EL - start_time_EL, end_time_ELK - start_time_ELK, end_time_HERMIT - start_time_HERMIT
+        return result, time_elapsed_EL, time_elapsed_ELK, time_elapsed_HERMIT
+
+
+# Per-process state: the gateway connection and the reasoners of the ontology the
+# process is working on, so every worker loads an ontology only once
+worker_state = {}
+
+
+def connect_gateway():
+    if "gateway" not in worker_state:
+        gateway = JavaGateway()
+        worker_state["gateway"] = gateway
+        worker_state["parser"] = gateway.getOWLParser()
+        worker_state["formatter"] = gateway.getSimpleDLFormatter()
+    return worker_state["gateway"], worker_state["parser"], worker_state["formatter"]
+
+
+# Budget for ELReasoner saturations from the limits on the command line, None when
+# there are none
+def make_budget(time_limit, args):
+    if time_limit is None and args.element_limit is None and args.memory_limit is None:
+        return None
+    memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit is not None else None
+    return Budget(time_limit, args.element_limit, memory_limit)
+
+
+def load_reasoners(ontology_file, args):
+    if worker_state.get("ontology_file") == ontology_file:
+        return worker_state["reasoners"]
+
+    gateway, parser, formatter = connect_gateway()
+    # Seconds spent in every loading phase, reported with the statistics
+    phases = {}
+
+    # With --world-cache the ontology is parsed once into a saved owlready2 world
+    # and the EL and HermiT paths share it
+    ontology_store = None
+    load = load_ontology
+    if args.world_cache:
+        ontology_store = worker_state.setdefault("ontology_store", OntologyStore(args.world_cache))
+        load = ontology_store.load
+
+    # Load ontology for ELReasoner
+    ontology_EL = timed(phases, "load_ontology_EL", load, ontology_file)
+    reasoner_EL = ELReasoner(ontology_EL, instrument=args.instrument, bitset_labels=args.bitset_labels,
+                             budget=make_budget(args.time_limit, args), class_budget=make_budget(args.class_time_limit, args))
+
+    # Classify the whole ontology once, per-class queries are lookups afterwards
+    if args.cache_dir:
+        timed(phases, "classify_EL", reasoner_EL.classify_cached, ontology_file, args.cache_dir)
+    else:
+        timed(phases, "classify_EL", reasoner_EL.classify)
+    classification_time_EL = phases["classify_EL"]
+    classification_cutoff_EL = reasoner_EL.cutoff
+    if args.verbose:
+        print(f"ELReasoner classified the ontology in {classification_time_EL:.5f} seconds ({reasoner_EL.elements_created} elements)")
+        if classification_cutoff_EL is not None:
+            print(f"ELReasoner classification stopped at the {classification_cutoff_EL} limit")
+
+    # Get all classes in the ontology, ordered by IRI: the order of ontology.classes()
+    # depends on what the worker loaded before, and every shard must slice the same list
+    class_index = reasoner_EL.get_class_index()
+    all_classes = sorted(reasoner_EL.compute_all_classes(), key=lambda class_name: class_index.lookup(class_name).iri)
+
+    # Limit the number of classes if limit flag specified
+    if args.limit is not None:
+        all_classes = all_classes[:args.limit]
+
+    # Load ontology for ELK with py4j
+    ontology_ELK = timed(phases, "load_ontology_ELK", parser.parseFile, ontology_file)
+    gateway.convertToBinaryConjunctions(ontology_ELK)
+    elFactory = gateway.getELFactory()
+    reasoner_ELK = gateway.getELKReasoner()
+    timed(phases, "set_ontology_ELK", reasoner_ELK.setOntology, ontology_ELK)
+
+    # Classify once on the Java side and transfer all subsumer sets in bulk
+    elk_batch = None
+    if args.elk_batch:
+        elk_batch = ELKBatch(reasoner_ELK, formatter)
+        elk_batch.classify()
+        if args.verbose:
+            print(f"ELK classified the ontology in {elk_batch.reasoning_time:.5f} seconds, "
+                  f"transferred in {elk_batch.transfer_time:.5f} seconds ({elk_batch.round_trips} round trips)")
+
+    # Load ontology for HermiT
+    ontology_HERMIT = timed(phases, "load_ontology_HERMIT", load, ontology_file)
+    timed(phases, "sync_reasoner_HERMIT", sync_reasoner, ontology_HERMIT.world)
+    class_index_HERMIT = ClassIndex(ontology_HERMIT)
+
+    worker_state["ontology_file"] = ontology_file
+    worker_state["reasoners"] = {
+        "reasoner_EL": reasoner_EL,
+        "classification_time_EL": classification_time_EL,
+        "classification_cutoff_EL": classification_cutoff_EL,
+        "phases": phases,
+        "ontology_load": ontology_store.load_times[ontology_file] if ontology_store is not None else None,
+        "all_classes": all_classes,
+        "reasoner_ELK": reasoner_ELK,
+        "elFactory": elFactory,
+        "formatter": formatter,
+        "elk_batch": elk_batch,
+        "class_index_HERMIT": class_index_HERMIT,
+    }
+    return worker_state["reasoners"]
+
+
+# Process the shard_index-th of shard_count contiguous slices of the class list,
+# skipping the classes in done. Results are streamed to the shard's part file.
+def process_shard(ontology_file, shard_index, shard_count, args, done=frozenset()):
+    reasoners = load_reasoners(ontology_file, args)
+    all_classes = reasoners["all_classes"]
+    start = shard_index * len(all_classes) // shard_count
+    end = (shard_index + 1) * len(all_classes) // shard_count
+    shard_classes = all_classes[start:end]
+
+    # Show progress bar if progress flag specified (only when running in one process)
+    if args.progress and args.jobs == 1:
+        shard_classes = tqdm(shard_classes)
+
+    path = part_path(results_path(args.output, ontology_file), shard_index, shard_count)
+    with ResultWriter(path, args.compact) as writer:
+        for class_name in shard_classes:
+            if class_name in done:
+                continue
+            reasoner = Reasoner(class_name, reasoners["reasoner_EL"], reasoners["reasoner_ELK"], reasoners["elFactory"],
+                                reasoners["formatter"], reasoners["class_index_HERMIT"], args, reasoners["elk_batch"])
+            if args.benchmark:
+                result = benchmark_class(reasoner, args.warmup, args.repeat)
+            else:
+                result = reasoner.process_class()[0]
+            writer.write(result)
+
+    shard = {
+        "classification_time_EL": reasoners["classification_time_EL"],
+        "classification_cutoff_EL": reasoners["classification_cutoff_EL"],
+        "elements_created": reasoners["reasoner_EL"].elements_created,
+        "phases": reasoners["phases"],
+    }
+    if reasoners["ontology_load"] is not None:
+        shard["ontology_load"] = reasoners["ontology_load"]
+    rule_stats = reasoners["reasoner_EL"].rule_stats()
+    if rule_stats is not None:
+        shard["rule_stats"] = rule_stats.as_dict()
+    elk_batch = reasoners["elk_batch"]
+    if elk_batch is not None:
+        shard["elk_batch"] = {
+            "classification_time": elk_batch.reasoning_time,
+            "transfer_time": elk_batch.transfer_time,
+            "round_trips": elk_batch.round_trips,
+            "bulk_transfer": elk_batch.bulk,
+        }
+    return shard
+
+
+# Prepare the results of one ontology before processing it. Returns the classes
+# already written by an earlier run, or None when the ontology is finished; its
+# statistics are then added to the aggregate results as they are.
+def prepare_results(ontology_file, args, aggregate_results):
+    os.makedirs(args.output, exist_ok=True)
+    path = results_path(args.output, ontology_file)
+    if not args.resume:
+        for stale_path in [path, compressed_path(path)] + part_paths(path):
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        return set()
+
+    statistics = finished_statistics(compressed_path(path, args.compress))
+    if statistics is not None:
+        record_aggregate(ontology_file, statistics, args, aggregate_results)
+        return None
+    done = set()
+    for existing_part in part_paths(path):
+        repair(existing_part)
+        for row in expand_results(read_results(existing_part)):
+            done.add(row["class_name"])
+    return done
+
+
+def record_aggregate(ontology_file, stats, args, aggregate_results):
+    # Add the stats to the aggregate results
+    aggregate_results[os.path.basename(ontology_file)] = stats
+
+    # Save the aggregate results after each ontology
+    with open(os.path.join(args.output, "aggregate_results.json"), "w") as f:
+        json.dump(aggregate_results, f, indent=2)
+
+
+# Concatenate the part files of one ontology into its results file, computing the
+# statistics on the way, and add them as the last line. With --compact the rows get
+# one name table for the whole file.
+def write_results(ontology_file, shards, args, aggregate_results):
+    path = results_path(args.output, ontology_file)
+    parts = part_paths(path)
+    encoder = CompactEncoder() if args.compact else None
+    running_stats = {reasoner_name: RunningStats() for reasoner_name in REASONER_NAMES}
+    # Per-class times for the percentiles of the benchmark mode
+    execution_times = {reasoner_name: [] for reasoner_name in REASONER_NAMES}
+    incomplete_EL = 0
+    temporary_path = compressed_path(f"{path}.tmp", args.compress)
+    with open_results(temporary_path, "w") as f:
+        for existing_part in parts:
+            for row in expand_results(read_results(existing_part)):
+                for reasoner_name, stats in running_stats.items():
+                    stats.add(row[reasoner_name]["execution_time"])
+                    if args.benchmark:
+                        execution_times[reasoner_name].append(row[reasoner_name]["execution_time"])
+                if "incomplete" in row["ELReasoner"]:
+                    incomplete_EL += 1
+                if encoder is not None:
+                    row = encoder.encode(row)
+                f.write(dump_row(row, args.compact))
+
+    total_time_EL, avg_time_EL, std_dev_EL = running_stats["ELReasoner"].stats()
+    total_time_ELK, avg_time_ELK, std_dev_ELK = running_stats["ELK"].stats()
+    total_time_HERMIT, avg_time_HERMIT, std_dev_HERMIT = running_stats["HermiT"].stats()
+
+    if args.verbose:
+        print(f"ELReasoner total time: {total_time_EL}, average time: {avg_time_EL}, standard deviation: {std_dev_EL}")
+        print(f"ELK total time: {total_time_ELK}, average time: {avg_time_ELK}, standard deviation: {std_dev_ELK}")
+        print(f"HermiT total time: {total_time_HERMIT}, average time: {avg_time_HERMIT}, standard deviation: {std_dev_HERMIT}")
+        print()
+
+    # Add the stats to the results. Every shard classifies the whole ontology, the
+    # slowest one is reported.
+    stats = {
+        "ELReasoner": {
+            "classification_time": max(shard["classification_time_EL"] for shard in shards),
+            "elements_created": shards[0]["elements_created"],
+            "total_time": total_time_EL,
+            "average_time": avg_time_EL,
+            "std_dev": std_dev_EL
+        },
+        "ELK": {
+            "total_time": total_time_ELK,
+            "average_time": avg_time_ELK,
+            "std_dev": std_dev_ELK
+        },
+        "HermiT": {
+            "total_time": total_time_HERMIT,
+            "average_time": avg_time_HERMIT,
+            "std_dev": std_dev_HERMIT
+        }
+    }
+    if args.benchmark:
+        for reasoner_name in REASONER_NAMES:
+            stats[reasoner_name].update(percentiles(execution_times[reasoner_name]))
+        stats["benchmark"] = {"warmup": args.warmup, "repeat": args.repeat}
+    # Classes answered with the subsumers found before a limit was hit
+    if args.time_limit is not None or args.class_time_limit is not None or args.element_limit is not None or args.memory_limit is not None:
+        stats["ELReasoner"]["classification_cutoff"] = next(
+            (shard["classification_cutoff_EL"] for shard in shards if shard["classification_cutoff_EL"] is not None), None)
+        stats["ELReasoner"]["incomplete_classes"] = incomplete_EL
+    if "rule_stats" in shards[0]:
+        stats["ELReasoner"]["rule_stats"] = shards[0]["rule_stats"]
+    stats["phases"] = {phase: max(shard["phases"][phase] for shard in shards) for phase in shards[0]["phases"]}
+    # Cold (parsed) or warm (saved world) ontology loads of --world-cache
+    if "ontology_load" in shards[0]:
+        stats["ontology_load"] = {
+            "load_time": max(shard["ontology_load"]["load_time"] for shard in shards),
+            "warm": all(shard["ontology_load"]["warm"] for shard in shards),
+        }
+    # In batch mode the ELK per-class times are lookups; reasoning and transfer are
+    # reported on their own
+    if "elk_batch" in shards[0]:
+        stats["ELK"].update({
+            "classification_time": max(shard["elk_batch"]["classification_time"] for shard in shards),
+            "transfer_time": max(shard["elk_batch"]["transfer_time"] for shard in shards),
+            "round_trips": shards[0]["elk_batch"]["round_trips"],
+            "bulk_transfer": shards[0]["elk_batch"]["bulk_transfer"],
+        })
+    with open_results(temporary_path, "a") as f:
+        f.write(json.dumps({"statistics": stats}) + "\n")
+    os.replace(temporary_path, compressed_path(path, args.compress))
+    for existing_part in parts:
+        os.remove(existing_part)
+
+    record_aggregate(ontology_file, stats, args, aggregate_results)
+
+
+# Run the shards in a process pool. Ontology files larger than shard_min_size are
+# split into one shard per job; results are merged and written in the same order
+# as a sequential run.
+def run_parallel(ontology_files, args, aggregate_results):
+    done = {}
+    for ontology_file in ontology_files:
+        try:
+            done[ontology_file] = prepare_results(ontology_file, args, aggregate_results)
+        except Exception as e:
+            print(f"Error processing {ontology_file}: {e}")
+    ontology_files = [ontology_file for ontology_file in ontology_files if done.get(ontology_file) is not None]
+
+    shard_counts = {}
+    for ontology_file in ontology_files:
+        shard_counts[ontology_file] = args.jobs if os.path.getsize(ontology_file) >= args.shard_min_size else 1
+
+    shards = {ontology_file: [None] * count for ontology_file, count in shard_counts.items()}
+    failed = {}
+    written = set()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {}
+        for ontology_file, count in shard_counts.items():
+            for shard_index in range(count):
+                future = executor.submit(process_shard, ontology_file, shard_index, count, args, done[ontology_file])
+                futures[future] = (ontology_file, shard_index)
+
+        completed = as_completed(futures)
+        if args.progress:
+            completed = tqdm(completed, total=len(futures))
+        for future in completed:
+            ontology_file, shard_index = futures[future]
+            if ontology_file in written:
+                continue
+            try:
+                shards[ontology_file][shard_index] = future.result()
+            except Exception as e:
+                failed[ontology_file] = e
+
+            # Write every ontology whose shards are all done, in input order
+            for pending_file in ontology_files:
+                if pending_file in written:
+                    continue
+                if pending_file in failed:
+                    print(f"Error processing {pending_file}: {failed[pending_file]}")
+                elif None not in shards[pending_file]:
+                    try:
+                        write_results(pending_file, shards[pending_file], args, aggregate_results)
+                    except Exception as e:
+                        print(f"Error processing {pending_file}: {e}")
+                else:
+                    break
+                written.add(pending_file)
 
 
 if __name__ == "__main__":
@@ -83,109 +423,58 @@ if __name__ == "__main__":
     arg_parser.add_argument("-v", "--verbose", action="store_true", help="Print details while processing")
     arg_parser.add_argument("-p", "--progress", action="store_true", help="Show progress bar")
     arg_parser.add_argument("-o", "--output", type=str, default=".", help="Output directory")
+    arg_parser.add_argument("-c", "--cache-dir", type=str, help="Directory for cached ELReasoner classifications, reused while the ontology file is unchanged")
+    arg_parser.add_argument("-w", "--world-cache", type=str,
+                            help="Directory for parsed ontologies saved as owlready2 SQLite worlds, reused while the ontology file is unchanged")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes")
+    arg_parser.add_argument("--shard-min-size", type=int, default=1000000,
+                            help="With --jobs, ontology files of at least this many bytes are split into one shard of classes per job")
+    arg_parser.add_argument("--elk-batch", action="store_true",
+                            help="Classify with ELK once and transfer all subsumer sets in bulk instead of querying per class")
+    arg_parser.add_argument("--benchmark", action="store_true",
+                            help="Run every class --warmup times unrecorded and --repeat times recorded, and report percentiles")
+    arg_parser.add_argument("--warmup", type=int, default=1, help="Unrecorded runs per class in benchmark mode")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Recorded runs per class in benchmark mode")
+    arg_parser.add_argument("--instrument", action="store_true",
+                            help="Count and time every ELReasoner completion rule and report them with the statistics")
+    arg_parser.add_argument("--bitset-labels", action="store_true", help="Store ELReasoner element labels as int bitsets")
+    arg_parser.add_argument("--time-limit", type=float,
+                            help="Seconds the ELReasoner may spend classifying an ontology; classes are then answered with the subsumers found so far")
+    arg_parser.add_argument("--class-time-limit", type=float,
+                            help="Seconds the ELReasoner may spend per class continuing a classification that was stopped at a limit")
+    arg_parser.add_argument("--element-limit", type=int, help="Largest number of model elements an ELReasoner saturation may create")
+    arg_parser.add_argument("--memory-limit", type=float, help="Megabytes of memory the process may use for ELReasoner saturations")
+    arg_parser.add_argument("--compact", action="store_true",
+                            help="Write class names once into a name table and subsumer lists as name IDs or bitmaps")
+    arg_parser.add_argument("--compress", action="store_true", help="Write the results file gzip compressed (.results.jsonl.gz)")
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="Keep the results of an earlier run in the output directory and skip the classes already written")
     args = arg_parser.parse_args()
-
-    # Connect to the Java Gateway ELK
-    gateway = JavaGateway()
-    parser = gateway.getOWLParser()
-    formatter = gateway.getSimpleDLFormatter()
+    if args.warmup < 0:
+        arg_parser.error("--warmup must not be negative")
+    if args.repeat < 1:
+        arg_parser.error("--repeat must be at least 1")
 
     if os.path.isdir(args.ontology_file):
-        ontology_files = glob.glob(os.path.join(args.ontology_file, "*.xml"))
+        ontology_files = sorted(glob.glob(os.path.join(args.ontology_file, "*.xml")))
     else:
         ontology_files = [args.ontology_file]
 
     aggregate_results = {}
 
-    for ontology_file in ontology_files:
-        try:
-            if args.verbose or args.progress:
-                print(f"Processing {ontology_file}")
-
-            # Load ontology for ELReasoner
-            ontology_EL = load_ontology(ontology_file)
-            reasoner_EL = ELReasoner(ontology_EL)
-
-            # Get all classes in the ontology
-            all_classes = reasoner_EL.compute_all_classes()
-
-            # Limit the number of classes if limit flag specified
-            if args.limit is not None:
-                all_classes = all_classes[:args.limit]
-
-            # Load ontology for ELK with py4j
-            ontology_ELK = parser.parseFile(ontology_file)
-            gateway.convertToBinaryConjunctions(ontology_ELK)
-            elFactory = gateway.getELFactory()
-            reasoner_ELK = gateway.getELKReasoner()
-            reasoner_ELK.setOntology(ontology_ELK)
-
-            # Load ontology for HermiT
-            ontology_HERMIT = load_ontology(ontology_file)
-            sync_reasoner()
-
-
-            results = []
-            execution_times_EL = []
-            execution_times_ELK = []
-            execution_times_HERMIT = []
-
-            # Show progress bar if progress flag specified
-            if args.progress:
-                all_classes = tqdm(all_classes)
-
-            # Process each class
-            for class_name in all_classes:
-                reasoner = Reasoner(class_name, reasoner_EL, reasoner_ELK, elFactory, formatter, args)
-                result, time_elapsed_EL, time_elapsed_ELK, time_elapsed_HERMIT = reasoner.process_class()
-                results.append(result)
-                execution_times_EL.append(time_elapsed_EL)
-                execution_times_ELK.append(time_elapsed_ELK)
-                execution_times_HERMIT.append(time_elapsed_HERMIT)
-
-            total_time_EL, avg_time_EL, std_dev_EL = reasoner.calculate_stats(execution_times_EL)
-            total_time_ELK, avg_time_ELK, std_dev_ELK = reasoner.calculate_stats(execution_times_ELK)
-            total_time_HERMIT, avg_time_HERMIT, std_dev_HERMIT = reasoner.calculate_stats(execution_times_HERMIT)
-
-            if args.verbose:
-                print(f"ELReasoner total time: {total_time_EL}, average time: {avg_time_EL}, standard deviation: {std_dev_EL}")
-                print(f"ELK total time: {total_time_ELK}, average time: {avg_time_ELK}, standard deviation: {std_dev_ELK}")
-                print(f"HermiT total time: {total_time_HERMIT}, average time: {avg_time_HERMIT}, standard deviation: {std_dev_HERMIT}")
-                print()
-
-            # Add the stats to the results
-            stats = {
-                "ELReasoner": {
-                    "total_time": total_time_EL,
-                    "average_time": avg_time_EL,
-                    "std_dev": std_dev_EL
-                },
-                "ELK": {
-                    "total_time": total_time_ELK,
-                    "average_time": avg_time_ELK,
-                    "std_dev": std_dev_ELK
-                },
-                "HermiT": {
-                    "total_time": total_time_HERMIT,
-                    "average_time": avg_time_HERMIT,
-                    "std_dev": std_dev_HERMIT
-                }
-            }
-            results.append({"statistics": stats})
-
-            # Create output directory if it doesn't exist
-            os.makedirs(args.output, exist_ok=True)
-
-            # Save the results of each ontology
-            with open(os.path.join(args.output, f"{os.path.basename(ontology_file)}.results.json"), "w") as f:
-                json.dump(results, f, indent=2)
-
-            # Add the stats to the aggregate results
-            aggregate_results[os.path.basename(ontology_file)] = stats
-
-            # Save the aggregate results after each ontology
-            with open(os.path.join(args.output, "aggregate_results.json"), "w") as f:
-                json.dump(aggregate_results, f, indent=2)
-
-        except Exception as e:
-            print(f"Error processing {ontology_file}: {e}")
+    if args.jobs > 1:
+        run_parallel(ontology_files, args, aggregate_results)
+    else:
+        for ontology_file in ontology_files:
+            try:
+                done = prepare_results(ontology_file, args, aggregate_results)
+                if done is None:
+                    continue
+                if args.verbose or args.progress:
+                    print(f"Processing {ontology_file}")
+
+                shard = process_shard(ontology_file, 0, 1, args, done)
+                write_results(ontology_file, [shard], args, aggregate_results)
+
+            except Exception as e:
+                print(f"Error processing {ontology_file}: {e}")
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+
+# Dictionary cache with an optional size limit (least recently used entries are
+# dropped first) and hit/miss counters
+class MemoCache:
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        if self.maxsize is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if self.maxsize is not None:
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,84 @@
+import glob
+import json
+import os
+import sqlite3
+import time
+
+from owlready2 import World
+
+from subsumption_cache import file_hash
+
+
+# Parsed ontologies kept as owlready2 SQLite quadstores in cache_dir, one world per
+# ontology file, keyed by the SHA-256 of its content. The first load parses the
+# OWL/XML and saves the world (cold); later runs open the saved world instead
+# (warm), which reads entities from SQLite on demand. Within a process every
+# caller gets the same ontology object, so the EL and HermiT paths share one copy.
+#
+# Every process works on its own in-memory copy of the saved world: owlready2 locks
+# the database it writes to, and changes made after loading (such as the
+# inferences of sync_reasoner) must not end up in the stored world.
+class OntologyStore:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.ontologies = {}
+        # File path -> {"load_time": seconds, "warm": whether a saved world was used}
+        self.load_times = {}
+
+    def world_path(self, file_path, digest):
+        return os.path.join(self.cache_dir, f"{os.path.basename(file_path)}.{digest.hex()[:16]}.sqlite3")
+
+    def load(self, file_path):
+        if file_path in self.ontologies:
+            return self.ontologies[file_path]
+
+        start_time = time.perf_counter()
+        path = self.world_path(file_path, file_hash(file_path))
+        # Base IRI and name of the main ontology, written once the world is complete
+        index_path = path + ".json"
+        warm = os.path.exists(path) and os.path.exists(index_path)
+        if not warm:
+            self.build(file_path, path, index_path)
+        with open(index_path) as f:
+            index = json.load(f)
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        connection = sqlite3.connect(":memory:", check_same_thread=False)
+        try:
+            source.backup(connection)
+        finally:
+            source.close()
+        ontology = World(filename=path, connection=connection).get_ontology(index["base_iri"]).load()
+        # The name owlready2 gives an ontology loaded from the file, which prefixes
+        # the entity names HermiT results are written with
+        ontology.name = index["name"]
+
+        self.ontologies[file_path] = ontology
+        self.load_times[file_path] = {"load_time": time.perf_counter() - start_time, "warm": warm}
+        return ontology
+
+    # Parse the file into a new world next to path and move it in place, so other
+    # processes never open a partial world. Worlds of older versions of the file
+    # are removed.
+    def build(self, file_path, path, index_path):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for stale_path in glob.glob(os.path.join(glob.escape(self.cache_dir), f"{glob.escape(os.path.basename(file_path))}.*.sqlite3*")):
+            if not stale_path.startswith(path):
+                os.remove(stale_path)
+
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        temporary_index_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            world = World(filename=temporary_path)
+            try:
+                ontology = world.get_ontology(file_path).load()
+                world.save()
+            finally:
+                world.close()
+            with open(temporary_index_path, "w") as f:
+                json.dump({"file": os.path.basename(file_path), "base_iri": ontology.base_iri, "name": ontology.name}, f)
+            os.replace(temporary_path, path)
+            os.replace(temporary_index_path, index_path)
+        finally:
+            for leftover_path in glob.glob(glob.escape(temporary_path) + "*") + [temporary_index_path]:
+                if os.path.exists(leftover_path):
+                    os.remove(leftover_path)
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from class_index import AmbiguousClassName
+from G18_Reasoner import ELReasoner, load_ontology
+from ontology_store import OntologyStore
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+                500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+# Raised while handling a request, turned into an HTTP error response
+class QueryError(Exception):
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+# One configured ontology: loaded and classified in the background, queried from
+# its classified state once ready
+class ServedOntology:
+    def __init__(self, ontology_file):
+        self.ontology_file = ontology_file
+        self.name = os.path.basename(ontology_file)
+        self.reasoner = None
+        self.state = "queued"
+        self.error = None
+        self.load_time = None
+        self.classification_time = None
+        self.ready = asyncio.get_running_loop().create_future()
+
+    # Runs in the loader thread
+    def load(self, ontology_store, cache_dir):
+        self.state = "loading"
+        start_time = time.perf_counter()
+        ontology = ontology_store.load(self.ontology_file) if ontology_store is not None else load_ontology(self.ontology_file)
+        self.load_time = time.perf_counter() - start_time
+
+        self.state = "classifying"
+        start_time = time.perf_counter()
+        reasoner = ELReasoner(ontology)
+        if cache_dir:
+            reasoner.classify_cached(self.ontology_file, cache_dir)
+        else:
+            reasoner.classify()
+        reasoner.get_class_index()
+        self.classification_time = time.perf_counter() - start_time
+        self.reasoner = reasoner
+
+    def status(self):
+        return {
+            "file": self.ontology_file,
+            "state": self.state,
+            "error": self.error,
+            "load_time": self.load_time,
+            "classification_time": self.classification_time,
+        }
+
+    # Whether answering the class needs the reasoner to saturate (a class outside the
+    # classification, or a cut-off classification continued within its class budget)
+    # instead of a lookup in the classification
+    def needs_saturation(self, class_name):
+        reasoner = self.reasoner
+        try:
+            target_class = reasoner.get_class_index().lookup(class_name)
+        except AmbiguousClassName:
+            return False
+        if target_class is None:
+            return False
+        return target_class not in reasoner.subsumer_map or (reasoner.cutoff is not None and reasoner.class_budget is not None)
+
+    def subsumers(self, class_name):
+        try:
+            if self.reasoner.get_class_index().lookup(class_name) is None:
+                raise QueryError(404, f"no class '{class_name}' in {self.name}")
+            return self.reasoner.compute_subsumers(class_name)
+        except AmbiguousClassName as e:
+            raise QueryError(409, str(e), candidates=e.candidates)
+
+
+# Long-running subsumption query server. The configured ontologies are loaded and
+# classified one after the other in a background thread, while the event loop
+# keeps answering queries for the ontologies that are ready (queries for the
+# others wait for them, or fail with 503 when wait=0).
+#
+# HTTP/1.1 over TCP or a Unix socket, JSON responses:
+#   GET  /ontologies                                 state of every ontology
+#   GET  /subsumers?ontology=NAME&class=CLASS[&wait=0]
+#   POST /subsumers  {"ontology": NAME, "classes": [CLASS, ...], "wait": true}
+class QueryServer:
+    def __init__(self, ontology_files, cache_dir=None, world_cache=None):
+        self.ontology_files = ontology_files
+        self.cache_dir = cache_dir
+        self.ontology_store = OntologyStore(world_cache) if world_cache else None
+        self.ontologies = {}
+        self.queries = 0
+        # One loader thread: owlready2 loading is not made for concurrent use, so
+        # queries that saturate (and compile owlready2 constructs) run there too
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def classify_all(self):
+        loop = asyncio.get_running_loop()
+        for served in self.ontologies.values():
+            try:
+                await loop.run_in_executor(self.executor, served.load, self.ontology_store, self.cache_dir)
+                served.state = "ready"
+                served.ready.set_result(True)
+            except Exception as e:
+                served.state = "failed"
+                served.error = str(e)
+                served.ready.set_result(False)
+
+    # Subsumers of a class, looked up on the event loop when they are in the
+    # classification and computed on the loader thread otherwise
+    async def subsumers(self, served, class_name):
+        if served.needs_saturation(class_name):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, served.subsumers, class_name)
+        return served.subsumers(class_name)
+
+    def get_ontology(self, name):
+        served = self.ontologies.get(name)
+        if served is None:
+            raise QueryError(404, f"unknown ontology '{name}'", ontologies=list(self.ontologies))
+        return served
+
+    async def wait_ready(self, served, wait):
+        if not served.ready.done():
+            if not wait:
+                raise QueryError(503, f"{served.name} is still {served.state}")
+            await asyncio.shield(served.ready)
+        if served.reasoner is None:
+            raise QueryError(503, f"{served.name} failed to load: {served.error}")
+
+    async def query(self, served, class_names, wait):
+        await self.wait_ready(served, wait)
+        results = []
+        for class_name in class_names:
+            self.queries += 1
+            try:
+                results.append({"class": class_name, "subsumers": await self.subsumers(served, class_name)})
+            except QueryError as e:
+                results.append({"class": class_name, "error": str(e), **e.details})
+        return results
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/ontologies":
+            if method != "GET":
+                raise QueryError(405, "use GET")
+            return {"ontologies": {name: served.status() for name, served in self.ontologies.items()}, "queries": self.queries}
+
+        if url.path == "/subsumers":
+            if method == "GET":
+                if "ontology" not in params or "class" not in params:
+                    raise QueryError(400, "ontology and class parameters are required")
+                served = self.get_ontology(params["ontology"])
+                await self.wait_ready(served, params.get("wait", "1") != "0")
+                self.queries += 1
+                return {"ontology": served.name, "class": params["class"], "subsumers": await self.subsumers(served, params["class"])}
+            if method == "POST":
+                try:
+                    request = json.loads(body or b"{}")
+                    class_names = request["classes"]
+                    if not isinstance(class_names, list) or not all(isinstance(class_name, str) for class_name in class_names):
+                        raise TypeError("classes must be a list of class names")
+                    served = self.get_ontology(request["ontology"])
+                except (ValueError, KeyError, TypeError) as e:
+                    raise QueryError(400, f"expected {{\"ontology\": ..., \"classes\": [...]}}: {e}")
+                return {"ontology": served.name, "results": await self.query(served, class_names, request.get("wait", True))}
+            raise QueryError(405, "use GET or POST")
+
+        raise QueryError(404, f"no route {url.path}")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, response = 200, await self.route(method, target, body)
+                except QueryError as e:
+                    status, response = e.status, {"error": str(e), **e.details}
+                except Exception as e:
+                    status, response = 500, {"error": str(e)}
+
+                payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write((f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                              f"Content-Type: application/json\r\n"
+                              f"Content-Length: {len(payload)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8018, unix_socket=None):
+        for ontology_file in self.ontology_files:
+            served = ServedOntology(ontology_file)
+            self.ontologies[served.name] = served
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            print(f"Serving on {unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Serving on http://{host}:{server.sockets[0].getsockname()[1]}")
+        classification = asyncio.ensure_future(self.classify_all())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            classification.cancel()
+            self.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="EL Reasoner subsumption query server")
+    arg_parser.add_argument("ontology_files", nargs="+", help="Ontology files to load and classify")
+    arg_parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    arg_parser.add_argument("--port", type=int, default=8018, help="Port to listen on")
+    arg_parser.add_argument("--unix-socket", type=str, help="Listen on this Unix socket instead of TCP")
+    arg_parser.add_argument("-c", "--cache-dir", type=str, help="Directory for cached classifications")
+    arg_parser.add_argument("-w", "--world-cache", type=str, help="Directory for parsed ontologies saved as owlready2 worlds")
+    args = arg_parser.parse_args()
+
+    server = QueryServer(args.ontology_files, args.cache_dir, args.world_cache)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,274 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from benchmark import elapsed_seconds, percentiles
+from el_saturation import Saturation
+from G18_Reasoner import FILTERED_CLASS_NAMES, ELReasoner, load_ontology
+from result_writer import expand_results, read_results
+
+# Regression gate: classify every ontology that has stored results again with the
+# current ELReasoner and compare the subsumers of every stored class with the stored
+# ELK (or HermiT) answers. The gate fails on classes that disagree with the
+# reference other than as accepted in the known file, {ontology file name: {class
+# name: {"missing": [...], "extra": [...]}}}. It also fails when the classification
+# time of an ontology, or the mean or p95 time of saturating one of its classes
+# alone in a fresh model, is more than the threshold above the reference timings
+# in the timings file, and when an ontology has no reference timings. The timings
+# depend on the machine; record them again with --update-timings on another one.
+#
+# The stored ELReasoner answers are no baseline for either: they were computed in
+# the world HermiT's sync_reasoner() had already rewritten, and with per-class
+# saturations instead of one classification.
+
+BASELINE_SUFFIXES = (".results.json", ".results.jsonl", ".results.jsonl.gz")
+TIMING_STATISTICS = ("classification_time", "class_mean", "class_p95")
+
+
+def baseline_path(baseline_dir, ontology_file):
+    for suffix in BASELINE_SUFFIXES:
+        path = os.path.join(baseline_dir, os.path.basename(ontology_file) + suffix)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# Class name -> row of stored results, written as one JSON list (as in results5) or
+# as JSON Lines by the comparison script (compact or compressed)
+def load_baseline(path):
+    if not path.endswith(".json"):
+        rows = list(expand_results(read_results(path)))
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    return {row["class_name"]: row for row in rows if "class_name" in row}
+
+
+# Subsumer names as the ELReasoner writes them: ELK may quote names and lists ⊤,
+# HermiT prefixes names with their namespace and lists owl.Thing
+def normalize_subsumers(reasoner_name, subsumers):
+    if reasoner_name == "HermiT":
+        names = {name.rsplit(".", 1)[-1] for name in subsumers}
+    else:
+        names = {name.strip('"') for name in subsumers} - {"⊤"}
+    return names - set(FILTERED_CLASS_NAMES)
+
+
+# Fresh ELK subsumers of every class through the py4j gateway, or None when the
+# gateway is not running
+def live_elk_subsumers(ontology_file):
+    try:
+        from py4j.java_gateway import JavaGateway
+        from py4j.protocol import Py4JNetworkError
+    except ImportError:
+        return None
+    from elk_batch import ELKBatch
+
+    gateway = JavaGateway()
+    try:
+        parser = gateway.getOWLParser()
+    except Py4JNetworkError:
+        return None
+    ontology_ELK = parser.parseFile(ontology_file)
+    gateway.convertToBinaryConjunctions(ontology_ELK)
+    reasoner_ELK = gateway.getELKReasoner()
+    reasoner_ELK.setOntology(ontology_ELK)
+    elk_batch = ELKBatch(reasoner_ELK, gateway.getSimpleDLFormatter())
+    elk_batch.classify()
+    return elk_batch
+
+
+def latency(times):
+    return {"mean": sum(times) / len(times) if times else float("nan"), "p95": percentiles(times)["p95"]}
+
+
+# Fastest of repeat classifications of the ontology, each with a new ELReasoner,
+# after one untimed warm-up classification, and the last reasoner
+def time_classification(ontology, repeat):
+    ELReasoner(ontology).classify()
+    best = None
+    for _ in range(repeat):
+        reasoner = ELReasoner(ontology)
+        start_ns = time.perf_counter_ns()
+        reasoner.classify()
+        classification_time = elapsed_seconds(start_ns)
+        best = classification_time if best is None else min(best, classification_time)
+    return best, reasoner
+
+
+# Fastest of repeat saturations of every class alone, in a fresh model over the
+# compiled TBox of the classified reasoner: the reasoning a single-class query
+# costs, without the lookups answered from the classification
+def time_class_saturations(reasoner, classes, repeat):
+    tbox = reasoner.compile()
+    times = []
+    for target_class in classes:
+        best = None
+        for _ in range(repeat):
+            start_ns = time.perf_counter_ns()
+            saturation = Saturation(tbox, reasoner.shared_successors)
+            saturation.add_root(tbox.add_class(target_class))
+            saturation.run()
+            saturation_time = elapsed_seconds(start_ns)
+            best = saturation_time if best is None else min(best, saturation_time)
+        times.append(best)
+    return times
+
+
+def read_json(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def check_ontology(ontology_file, baseline, known, timings, args):
+    reference_name = "HermiT" if args.reference == "hermit" else "ELK"
+    elk_batch = None if args.offline or args.reference == "hermit" else live_elk_subsumers(ontology_file)
+
+    ontology = load_ontology(ontology_file)
+    classification_time, reasoner = time_classification(ontology, args.repeat)
+
+    classes = []
+    missing = []
+    disagreements = {}
+    for class_name, row in baseline.items():
+        try:
+            target_class = reasoner.get_class_index().lookup(class_name)
+            if target_class is None:
+                raise LookupError(class_name)
+            subsumers = set(reasoner.compute_subsumers(class_name))
+        except LookupError:
+            missing.append(class_name)
+            continue
+        classes.append(target_class)
+
+        if elk_batch is not None:
+            reference = normalize_subsumers("ELK", elk_batch.get_subsumers(class_name))
+        else:
+            reference = normalize_subsumers(reference_name, row[reference_name]["subsumers"])
+        if subsumers != reference:
+            disagreement = {"missing": sorted(reference - subsumers), "extra": sorted(subsumers - reference)}
+            disagreement["known"] = known.get(class_name) == {key: disagreement[key] for key in ("missing", "extra")}
+            disagreements[class_name] = disagreement
+
+    class_latency = latency(time_class_saturations(reasoner, classes, args.repeat))
+    current = {"classification_time": classification_time, "class_mean": class_latency["mean"], "class_p95": class_latency["p95"]}
+    failures = []
+    new_disagreements = [class_name for class_name, disagreement in disagreements.items() if not disagreement["known"]]
+    if new_disagreements:
+        failures.append(f"{len(new_disagreements)} classes disagree with {reference_name} other than accepted")
+    if missing:
+        failures.append(f"{len(missing)} stored classes not found")
+    # Timings being recorded again are not compared
+    if not args.update_timings:
+        if timings is None:
+            failures.append(f"no recorded timings in {args.timings}, record them with --update-timings")
+        else:
+            for statistic in TIMING_STATISTICS:
+                if current[statistic] > timings[statistic] * (1 + args.threshold) + args.min_regression:
+                    failures.append(f"{statistic} {current[statistic]:.6f}s is above the recorded {timings[statistic]:.6f}s")
+
+    return {
+        "classes": len(baseline),
+        "reference": reference_name,
+        "live_reference": elk_batch is not None,
+        "timings": {"recorded": timings, "current": current},
+        "missing": missing,
+        "disagreements": disagreements,
+        "failures": failures,
+    }
+
+
+def print_report(name, report, verbose):
+    source = "live" if report["live_reference"] else "stored"
+    current = report["timings"]["current"]
+    recorded = report["timings"]["recorded"] or {}
+    print(f"{name}: {report['classes']} classes, {len(report['disagreements'])} disagree with {source} {report['reference']}, "
+          + ", ".join(f"{statistic} {current[statistic]:.6f}s"
+                      + (f" (recorded {recorded[statistic]:.6f}s)" if statistic in recorded else "")
+                      for statistic in TIMING_STATISTICS)
+          + f": {'FAIL' if report['failures'] else 'ok'}")
+    for failure in report["failures"]:
+        print(f"  {failure}")
+    if verbose:
+        for class_name, disagreement in report["disagreements"].items():
+            print(f"  {class_name}{' (known)' if disagreement['known'] else ''}: "
+                  f"missing {disagreement['missing']}, extra {disagreement['extra']}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="ELReasoner correctness and latency regression gate")
+    arg_parser.add_argument("ontology_file", type=str, nargs="?", default="Project-1_ontologies",
+                            help="Ontology file or directory containing XML files")
+    arg_parser.add_argument("-b", "--baseline", type=str, default="results5", help="Directory with the stored results")
+    arg_parser.add_argument("--reference", choices=["elk", "hermit"], default="elk", help="Reasoner whose answers are expected")
+    arg_parser.add_argument("--offline", action="store_true", help="Use the stored ELK answers without trying the ELK gateway")
+    arg_parser.add_argument("--threshold", type=float, default=1.0,
+                            help="Fraction the timings may be above the recorded ones")
+    arg_parser.add_argument("--min-regression", type=float, default=0.000005,
+                            help="Seconds the timings may be above the recorded ones regardless of the threshold")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+                            help="Classifications and single-class saturations to take the fastest of")
+    arg_parser.add_argument("--known", type=str, default="regression_known.json",
+                            help="JSON file with the accepted disagreements of every ontology")
+    arg_parser.add_argument("--update-known", action="store_true", help="Accept the current disagreements into the --known file")
+    arg_parser.add_argument("--timings", type=str, default="regression_timings.json",
+                            help="JSON file with the recorded timings of every ontology")
+    arg_parser.add_argument("--update-timings", action="store_true", help="Record the current timings into the --timings file")
+    arg_parser.add_argument("--report", type=str, help="Write the full report to this JSON file")
+    arg_parser.add_argument("-v", "--verbose", action="store_true", help="List every disagreeing class")
+    args = arg_parser.parse_args()
+    if args.repeat < 1:
+        arg_parser.error("--repeat must be at least 1")
+
+    if os.path.isdir(args.ontology_file):
+        ontology_files = sorted(glob.glob(os.path.join(args.ontology_file, "*.xml")))
+    else:
+        ontology_files = [args.ontology_file]
+
+    known = read_json(args.known)
+    timings = read_json(args.timings)
+    reports = {}
+    for ontology_file in ontology_files:
+        path = baseline_path(args.baseline, ontology_file)
+        if path is None:
+            continue
+        name = os.path.basename(ontology_file)
+        recorded = timings.get(name)
+        try:
+            reports[name] = check_ontology(ontology_file, load_baseline(path), known.get(name, {}), recorded, args)
+        except Exception as e:
+            reports[name] = {"error": str(e), "failures": [f"error: {e}"]}
+            print(f"{name}: FAIL\n  error: {e}")
+            continue
+        print_report(name, reports[name], args.verbose)
+
+    if args.update_known:
+        for name, report in reports.items():
+            if "disagreements" in report:
+                known[name] = {class_name: {key: disagreement[key] for key in ("missing", "extra")}
+                               for class_name, disagreement in report["disagreements"].items()}
+        write_json(args.known, known)
+    if args.update_timings:
+        for name, report in reports.items():
+            if "timings" in report:
+                timings[name] = report["timings"]["current"]
+        write_json(args.timings, timings)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(reports, f, indent=2)
+    if not reports:
+        sys.exit(f"No stored results in {args.baseline} for {args.ontology_file}")
+    failed = [name for name, report in reports.items() if report["failures"]]
+    if failed:
+        sys.exit(f"Regression gate failed for {', '.join(failed)}")
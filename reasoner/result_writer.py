@@ -0,0 +1,213 @@
+import base64
+import glob
+import gzip
+import json
+import math
+import os
+import sys
+
+
+# Count, total, mean and standard deviation of a stream of numbers without keeping
+# them (Welford's algorithm). std is the population standard deviation, like np.std.
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.mean = 0.0
+        self.squares = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squares += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self.squares / self.count) if self.count else 0.0
+
+    def stats(self):
+        return self.total, self.mean if self.count else math.nan, self.std if self.count else math.nan
+
+
+# Results are written as JSON Lines, one line per class as soon as it is processed,
+# so memory stays bounded and a crash only loses the line being written. Every shard
+# writes its own part file; once all shards are done the parts are concatenated into
+# <ontology>.results.jsonl (gzip compressed as <ontology>.results.jsonl.gz),
+# followed by a {"statistics": ...} line.
+def results_path(output_dir, ontology_file):
+    return os.path.join(output_dir, f"{os.path.basename(ontology_file)}.results.jsonl")
+
+
+def compressed_path(path, compress=True):
+    return path + ".gz" if compress else path
+
+
+def open_results(path, mode="r"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def part_path(path, shard_index, shard_count):
+    return f"{path}.part{shard_index:04d}of{shard_count:04d}"
+
+
+def part_paths(path):
+    return sorted(glob.glob(glob.escape(path) + ".part*"))
+
+
+# Drop a partially written last line, left behind when a run was killed mid-write
+def repair(path):
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+# Parsed lines of a results file, skipping any that are not valid JSON. Compact
+# rows are returned as they are, see expand_results().
+def read_results(path):
+    with open_results(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+# Compact rows: every class name is written once, in the "names" list of the first
+# row that uses it, and is referred to by its position in the file's name table
+# afterwards. The class is "class" instead of "class_name", and every subsumer list
+# is a sorted list of name IDs, or {"bits": base64} of a little-endian bitmap of
+# them, whichever is shorter. A count equal to the number of subsumers is left out.
+# Other fields are kept as they are.
+class CompactEncoder:
+    def __init__(self):
+        self.ids = {}
+
+    # Continue the name table of an existing file
+    def add_names(self, names):
+        for name in names:
+            self.ids.setdefault(name, len(self.ids))
+
+    def name_id(self, name, new_names):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.ids[name] = len(self.ids)
+            new_names.append(name)
+        return name_id
+
+    def encode_names(self, names, new_names):
+        ids = sorted({self.name_id(name, new_names) for name in names})
+        mask = 0
+        for name_id in ids:
+            mask |= 1 << name_id
+        bitmap = base64.b64encode(mask.to_bytes((mask.bit_length() + 7) // 8, "little")).decode("ascii")
+        if len(bitmap) + 10 < len(json.dumps(ids)):
+            return {"bits": bitmap}
+        return ids
+
+    def encode(self, row):
+        new_names = []
+        compact = {"class": self.name_id(row["class_name"], new_names)}
+        for key, value in row.items():
+            if key == "class_name":
+                continue
+            if isinstance(value, dict) and "subsumers" in value:
+                subsumers = self.encode_names(value["subsumers"], new_names)
+                size = len(subsumers) if isinstance(subsumers, list) else len(set(value["subsumers"]))
+                value = {field: subsumers if field == "subsumers" else field_value for field, field_value in value.items()
+                         if field != "count" or field_value != size}
+            compact[key] = value
+        if new_names:
+            compact["names"] = new_names
+        return compact
+
+
+class CompactDecoder:
+    def __init__(self):
+        self.names = []
+
+    def decode_names(self, encoded):
+        if isinstance(encoded, dict):
+            mask = int.from_bytes(base64.b64decode(encoded["bits"]), "little")
+            encoded = [name_id for name_id in range(mask.bit_length()) if mask >> name_id & 1]
+        return [self.names[name_id] for name_id in encoded]
+
+    def decode(self, row):
+        if "class" not in row:
+            return row
+        self.names.extend(row.get("names", ()))
+        expanded = {"class_name": self.names[row["class"]]}
+        for key, value in row.items():
+            if key in ("class", "names"):
+                continue
+            if isinstance(value, dict) and "subsumers" in value:
+                subsumers = self.decode_names(value["subsumers"])
+                fields = {}
+                for field, field_value in value.items():
+                    fields[field] = subsumers if field == "subsumers" else field_value
+                    if field == "subsumers" and "count" not in value:
+                        fields["count"] = len(subsumers)
+                value = fields
+            expanded[key] = value
+        return expanded
+
+
+# The rows of one results file in the plain JSON view, compact or not. Subsumer
+# lists of compact rows come back in name table order.
+def expand_results(rows):
+    decoder = CompactDecoder()
+    for row in rows:
+        yield decoder.decode(row)
+
+
+# Statistics line of a finished results file, or None
+def finished_statistics(path):
+    if not os.path.exists(path):
+        return None
+    statistics = None
+    for row in read_results(path):
+        statistics = row.get("statistics")
+    return statistics
+
+
+def dump_row(row, compact=False):
+    return json.dumps(row, ensure_ascii=False, separators=(",", ":") if compact else None) + "\n"
+
+
+# Appends rows to a results file, as compact rows when compact is set. A compact
+# writer continues the name table of the rows already in the file.
+class ResultWriter:
+    def __init__(self, path, compact=False):
+        self.encoder = None
+        if compact:
+            self.encoder = CompactEncoder()
+            if os.path.exists(path):
+                for row in read_results(path):
+                    self.encoder.add_names(row.get("names", ()))
+        self.file = open_results(path, "a")
+
+    def write(self, row):
+        if self.encoder is not None and "class_name" in row:
+            row = self.encoder.encode(row)
+        self.file.write(dump_row(row, self.encoder is not None))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Print a results file, compact and compressed or not, as plain JSON Lines
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        for row in expand_results(read_results(path)):
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+
+from el_tbox import CompiledTBox
+
+# On-disk cache of a classification: the compiled TBox indexes and the subsumer
+# sets of every classified class, keyed by the SHA-256 of the ontology file.
+#
+# Layout (native byte order):
+#   magic (8 bytes) | ontology hash (32) | payload length (8) | payload crc32 (4)
+#   header length (4) | JSON header | padding to 4 bytes | int32 arrays
+#
+# The JSON header holds the string tables (IRIs and names) and the offset and
+# length of every int32 array. Lists of lists are stored CSR style, as an
+# "_offsets" array plus a flat values array. Loading memory-maps the file and
+# reads the arrays in place.
+MAGIC = b"G18SUB02"
+PREAMBLE = struct.Struct("=8s32sQI")
+
+KIND_TOP, KIND_NAMED, KIND_AND, KIND_SOME = range(4)
+
+
+# Raised for files that are not a valid cache for the given ontology
+class StaleCacheError(Exception):
+    pass
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def cache_path(cache_dir, ontology_file):
+    return os.path.join(cache_dir, os.path.basename(ontology_file) + ".g18cache")
+
+
+def flatten(rows, width=1):
+    offsets = array("i", [0])
+    values = array("i")
+    for row in rows:
+        for item in row:
+            if width == 1:
+                values.append(item)
+            else:
+                values.extend(item)
+        offsets.append(len(values) // width)
+    return offsets, values
+
+
+def save_classification(path, digest, tbox, subsumer_ids):
+    concept_iris = []
+    concept_names = []
+    kinds = array("i")
+    some_keys = array("i")
+    and_parts = []
+    for concept_id, concept in enumerate(tbox.concepts):
+        parts = ()
+        role_id = filler_id = -1
+        if concept_id in tbox.named:
+            kinds.append(KIND_NAMED)
+            concept_iris.append(concept.iri)
+            concept_names.append(concept.name)
+        else:
+            concept_iris.append(None)
+            concept_names.append(None)
+            if isinstance(concept, tuple) and concept[0] == "and":
+                kinds.append(KIND_AND)
+                parts = concept[1]
+            elif isinstance(concept, tuple) and concept[0] == "some":
+                kinds.append(KIND_SOME)
+                role_id, filler_id = concept[1], concept[2]
+            else:
+                kinds.append(KIND_TOP)
+        and_parts.append(parts)
+        some_keys.extend((role_id, filler_id))
+
+    arrays = {"kinds": kinds, "some_keys": some_keys}
+    arrays["and_offsets"], arrays["and"] = flatten(and_parts)
+    arrays["told_offsets"], arrays["told"] = flatten(tbox.told_subsumers)
+    arrays["conj_offsets"], arrays["conj"] = flatten(tbox.conjunctions, 2)
+    arrays["exist_offsets"], arrays["exist"] = flatten(tbox.existentials, 2)
+    arrays["filler_offsets"], arrays["filler"] = flatten(
+        [[(role_id, result) for role_id, results in fillers.items() for result in results] for fillers in tbox.existential_fillers], 2)
+    arrays["super_role_offsets"], arrays["super_role"] = flatten(tbox.told_super_roles)
+    arrays["role_chains"] = array("i", [role_id for chain in tbox.role_chains for role_id in chain])
+    roots = list(subsumer_ids)
+    arrays["roots"] = array("i", roots)
+    arrays["subsumer_offsets"], arrays["subsumer"] = flatten([sorted(subsumer_ids[root]) for root in roots])
+
+    header = {
+        "concept_iris": concept_iris,
+        "concept_names": concept_names,
+        # IRIs of the named roles, None for the auxiliary roles of chains, which are
+        # listed with their key as [role ID, first, second]
+        "role_iris": [None if isinstance(role, tuple) else role.iri for role in tbox.roles],
+        "chain_roles": [[role_id, role[1], role[2]] for role_id, role in enumerate(tbox.roles) if isinstance(role, tuple)],
+        "arrays": {},
+    }
+    position = 0
+    for name, values in arrays.items():
+        header["arrays"][name] = [position, len(values)]
+        position += len(values) * 4
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    padding = b"\0" * (-(4 + len(header_bytes)) % 4)
+
+    payload = [struct.pack("=I", len(header_bytes)), header_bytes, padding]
+    for values in arrays.values():
+        payload.append(values.tobytes())
+    payload = b"".join(payload)
+
+    # Write next to the target and rename, so readers never see a partial file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, digest, len(payload), zlib.crc32(payload)))
+        f.write(payload)
+    os.replace(temporary_path, path)
+
+
+# A cache file mapped into memory
+class CachedClassification:
+    def __init__(self, path, digest):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.check(digest)
+        except Exception:
+            self.close()
+            raise
+
+    def check(self, digest):
+        if len(self.buffer) < PREAMBLE.size:
+            raise StaleCacheError("truncated cache file")
+        magic, cached_digest, length, crc = PREAMBLE.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise StaleCacheError("not a cache file or an old format")
+        if cached_digest != digest:
+            raise StaleCacheError("ontology file changed")
+        if len(self.buffer) != PREAMBLE.size + length:
+            raise StaleCacheError("truncated cache file")
+        payload = memoryview(self.buffer)[PREAMBLE.size:]
+        if zlib.crc32(payload) != crc:
+            payload.release()
+            raise StaleCacheError("checksum mismatch")
+        (header_length,) = struct.unpack_from("=I", payload)
+        try:
+            self.header = json.loads(bytes(payload[4:4 + header_length]))
+        except ValueError as e:
+            raise StaleCacheError(f"bad header: {e}")
+        finally:
+            payload.release()
+        self.data_start = PREAMBLE.size + 4 + header_length + (-(4 + header_length) % 4)
+
+    def array(self, name):
+        offset, count = self.header["arrays"][name]
+        start = self.data_start + offset
+        return memoryview(self.buffer)[start:start + count * 4].cast("i")
+
+    def csr(self, name):
+        return self.array(name + "_offsets"), self.array(name)
+
+    def close(self):
+        self.buffer.close()
+
+    # Root concept ID -> subsumer concept IDs
+    def subsumer_ids(self):
+        offsets, values = self.csr("subsumer")
+        return {root: values[offsets[index]:offsets[index + 1]] for index, root in enumerate(self.array("roots"))}
+
+    # Rebuild the compiled TBox; resolve_iri maps an IRI back to its owlready2 entity
+    def restore_tbox(self, resolve_iri, cache_size=None):
+        tbox = CompiledTBox(cache_size)
+        concept_iris = self.header["concept_iris"]
+        kinds = self.array("kinds")
+        some_keys = self.array("some_keys")
+        and_offsets, and_parts = self.csr("and")
+
+        for iri in self.header["role_iris"]:
+            tbox.new_role(resolve_iri(iri) if iri is not None else None)
+        for role_id, first_id, second_id in self.header["chain_roles"]:
+            tbox.roles[role_id] = ("chain", first_id, second_id)
+        tbox.role_ids = {role: role_id for role_id, role in enumerate(tbox.roles)}
+
+        for concept_id in range(1, len(kinds)):
+            kind = kinds[concept_id]
+            if kind == KIND_NAMED:
+                key = resolve_iri(concept_iris[concept_id])
+                tbox.named.add(concept_id)
+            elif kind == KIND_AND:
+                key = ("and", tuple(and_parts[and_offsets[concept_id]:and_offsets[concept_id + 1]]))
+            else:
+                key = ("some", some_keys[2 * concept_id], some_keys[2 * concept_id + 1])
+            tbox.new_concept(key)
+
+        def rows(name, width=1, count=len(kinds)):
+            offsets, values = self.csr(name)
+            values = values.tolist()
+            for index in range(count):
+                row = values[offsets[index] * width:offsets[index + 1] * width]
+                yield row if width == 1 else list(zip(row[0::2], row[1::2]))
+
+        tbox.told_subsumers = list(rows("told"))
+        tbox.conjunctions = list(rows("conj", 2))
+        tbox.existentials = list(rows("exist", 2))
+        tbox.existential_fillers = []
+        for pairs in rows("filler", 2):
+            fillers = {}
+            for role_id, result in pairs:
+                fillers.setdefault(role_id, []).append(result)
+            tbox.existential_fillers.append(fillers)
+        tbox.told_super_roles = list(rows("super_role", count=len(tbox.roles)))
+        chains = self.array("role_chains").tolist()
+        tbox.role_chains = list(zip(chains[0::3], chains[1::3], chains[2::3]))
+        tbox.update_role_tables()
+        return tbox
+
+
+# Open the cache file for an ontology, or None when it is missing, stale or corrupt
+def load_classification(path, digest):
+    if not os.path.exists(path):
+        return None
+    try:
+        return CachedClassification(path, digest)
+    except (StaleCacheError, OSError, ValueError, struct.error):
+        return None